@@ -1,33 +1,221 @@
 useLibrary('threads');
 importClass(java.io.File);
+importClass(java.io.FileOutputStream);
+importClass(java.io.OutputStreamWriter);
+importClass(java.nio.file.Files);
+importClass(java.security.MessageDigest);
 importClass(java.util.UUID);
 importClass(arkham.project.ProjectUtilities);
 importClass(arkham.sheet.RenderTarget);
+importClass(ca.cgjennings.apps.arkham.StrangeEons);
+importClass(ca.cgjennings.apps.arkham.diy.DIY);
+importClass(ca.cgjennings.apps.arkham.diy.DIYSheet);
 importClass(ca.cgjennings.apps.arkham.project.Project);
 importClass(ca.cgjennings.seplugins.csv.CsvFactory);
 importClass(ca.cgjennings.imageio.SimpleImageWriter);
 
-const PROJECT_FOLDER = 'SE_Generator';
+// NOTE: Declared with var, serve.js evaluates this script and only sees its var and function declarations.
+var PROJECT_FOLDER = 'SE_Generator';
 const TEMPLATE_FOLDER = 'template';
 const DATA_FOLDER = 'data';
 const CARD_FOLDER = 'cards';
 const IMAGE_FOLDER = 'images';
+const TIMING_FILE = 'timings.json';
+const REPORT_FILE = 'report.json';
+const MANIFEST_FILE = 'render.json';
+const PREFERENCES_FILE = 'preferences';
+const OPTIONS_FILE = 'options.json';
+const PPI = 300;
+const SYNTHESIZE_BLEED_MARGIN = false;
+
+// NOTE: The image formats handed over to the pack step. The PNG writer maps compression quality to deflate level, 0.85 is level 1.
+const IMAGE_FORMATS = {
+    'png': {format: 'png', extension: '.png'},
+    'png-fast': {format: 'png', extension: '.png', quality: 0.85},
+    'tiff': {format: 'tiff', extension: '.tif', compressed: false},
+};
+
+function createImageWriter(imageFormat) {
+    let imageWriter = new SimpleImageWriter(imageFormat.format);
+    if (imageFormat.quality !== undefined) {
+        imageWriter.setCompressionEnabled(true);
+        imageWriter.setCompressionQuality(imageFormat.quality);
+    }
+    if (imageFormat.compressed === false) {
+        imageWriter.setCompressionEnabled(false);
+    }
+    return imageWriter;
+}
 
 let headless = Eons.getScriptRunner() !== null;
-let project = headless ? Project.open(new File(PROJECT_FOLDER)) : Eons.getOpenProject();
+// NOTE: The render service hands each job's project folder to process, so there's no project to open.
+let project = typeof SERVICE !== 'undefined' ? null : headless ? Project.open(new File(PROJECT_FOLDER)) : Eons.getOpenProject();
+
+// NOTE: Split CSV text into the raw text of each record, keeping quoted line breaks within their record.
+function splitCsvRecords(csv) {
+    let records = [];
+    let start = 0;
+    let quoted = false;
+    for (let i = 0; i < csv.length; i++) {
+        let c = csv.charAt(i);
+        if (c === '"') {
+            quoted = !quoted;
+        } else if (c === '\n' && !quoted) {
+            let record = csv.substring(start, i).replace(/\r$/, '');
+            if (record.length > 0) {
+                records.push(record);
+            }
+            start = i + 1;
+        }
+    }
+    let record = csv.substring(start).replace(/\r$/, '');
+    if (record.length > 0) {
+        records.push(record);
+    }
+    return records;
+}
 
-let types = [];
-let dataFolder = new File(project.getFile(), DATA_FOLDER);
-let dataFiles = dataFolder.listFiles();
-for (let i = 0; i < dataFiles.length; i++) {
-    let dataFilename = dataFiles[i].getName();
-    if (dataFilename.endsWith('.csv')) {
-        let type = dataFilename.replace('.csv', '');
-        types.push(type);
+function getCsvFields(record) {
+    let fields = [];
+    let field = '';
+    let quoted = false;
+    for (let i = 0; i < record.length; i++) {
+        let c = record.charAt(i);
+        if (quoted) {
+            if (c === '"' && record.charAt(i + 1) === '"') {
+                field += c;
+                i++;
+            } else if (c === '"') {
+                quoted = false;
+            } else {
+                field += c;
+            }
+        } else if (c === '"') {
+            quoted = true;
+        } else if (c === ',') {
+            fields.push(field);
+            field = '';
+        } else {
+            field += c;
+        }
     }
+    fields.push(field);
+    return fields;
+}
+
+function getHash(parts) {
+    let digest = MessageDigest.getInstance('SHA-256');
+    for (let i = 0; i < parts.length; i++) {
+        let part = parts[i];
+        digest.update(typeof part === 'string' ? new java.lang.String(part).getBytes('UTF-8') : part);
+        digest.update(0);
+    }
+    let bytes = digest.digest();
+    let hash = '';
+    for (let i = 0; i < bytes.length; i++) {
+        hash += ('0' + (bytes[i] & 0xff).toString(16)).slice(-2);
+    }
+    return hash;
+}
+
+function readFileBytes(file) {
+    return file.exists() ? Files.readAllBytes(file.toPath()) : '';
+}
+
+// NOTE: Only one sheet of each card is painted. DIY components can create just that sheet, anything else creates all of its default sheets,
+// and so does everything after the first failure to create a single sheet.
+let singleSheets = true;
+// NOTE: The time the sheet is created is recorded in times, to tell sheet creation and painting apart.
+function paintSheet(card, index, ppi, times) {
+    if (singleSheets && card instanceof DIY) {
+        try {
+            let sheet = new DIYSheet(card, card.getTemplateKey(index), index);
+            times.sheet = java.lang.System.nanoTime();
+            return sheet.paint(RenderTarget.EXPORT, ppi, SYNTHESIZE_BLEED_MARGIN);
+        } catch (e) {
+            println('Creating all sheets instead: ' + e);
+            singleSheets = false;
+        }
+    }
+    let sheets = card.createDefaultSheets();
+    times.sheet = java.lang.System.nanoTime();
+    return sheets[index].paint(RenderTarget.EXPORT, ppi, SYNTHESIZE_BLEED_MARGIN);
+}
+
+// NOTE: Apply a CSV row to a component the way CsvFactory does, 'name' is the component name, keys starting with '$' are settings and
+// the 'port' keys are portrait properties. The source of a portrait is set first, because that resets its other properties.
+const PORTRAIT_KEY = /^port(\d+)(Src|Scale|X|Y|Rot)$/;
+function applyCsvRow(card, keys, values) {
+    card.clearAll();
+    let portraits = {};
+    for (let i = 0; i < keys.length; i++) {
+        let match = PORTRAIT_KEY.exec(keys[i]);
+        if (keys[i] === 'name') {
+            card.setName(values[i]);
+        } else if (keys[i].startsWith('$')) {
+            card.getSettings().set(keys[i].substring(1), values[i]);
+        } else if (match) {
+            portraits[match[1]] = portraits[match[1]] || {};
+            portraits[match[1]][match[2]] = values[i];
+        }
+    }
+    for (let n in portraits) {
+        if (parseInt(n) >= card.getPortraitCount()) {
+            continue;
+        }
+        let portrait = card.getPortrait(parseInt(n));
+        let properties = portraits[n];
+        if (properties.Src !== undefined) {
+            portrait.setSource(properties.Src);
+        }
+        if (properties.Scale !== undefined) {
+            portrait.setScale(parseFloat(properties.Scale));
+        }
+        if (properties.X !== undefined) {
+            portrait.setPanX(parseFloat(properties.X));
+        }
+        if (properties.Y !== undefined) {
+            portrait.setPanY(parseFloat(properties.Y));
+        }
+        if (properties.Rot !== undefined) {
+            portrait.setRotation(parseFloat(properties.Rot));
+        }
+    }
+    return card;
+}
+
+function getCsvRecord(values) {
+    return values.map(value => /[",\r\n]/.test(value) ? '"' + value.replace(/"/g, '""') + '"' : value).join(',');
 }
 
-function process(progress) {
+// NOTE: Snapshot the JVM heap in MB, to see how memory grows over a run.
+function getMemorySnapshot(stage) {
+    let runtime = java.lang.Runtime.getRuntime();
+    let total = runtime.totalMemory() / 1048576;
+    return {stage: stage, used: total - runtime.freeMemory() / 1048576, total: total, max: runtime.maxMemory() / 1048576};
+}
+
+// NOTE: Loaded templates are kept by their content, so that a render service only loads each template once.
+let templates = {};
+function loadTemplate(templateFile, templateBytes) {
+    let key = getHash([String(templateFile.getName()), templateBytes]);
+    if (!templates[key]) {
+        templates[key] = ResourceKit.getGameComponentFromFile(templateFile, true);
+    }
+    return templates[key];
+}
+
+function process(progress, projectFile) {
+    let types = [];
+    let dataFiles = new File(projectFile, DATA_FOLDER).listFiles();
+    for (let i = 0; i < dataFiles.length; i++) {
+        let dataFilename = dataFiles[i].getName();
+        if (dataFilename.endsWith('.csv')) {
+            let type = dataFilename.replace('.csv', '');
+            types.push(type);
+        }
+    }
+
     function syncProject() {
         if (!headless) {
             project.synchronizeAll();
@@ -35,6 +223,10 @@ function process(progress) {
     }
 
     function reportStatus(progress, status) {
+        // NOTE: The render service defines a heartbeat to tell it's still busy.
+        if (typeof heartbeat === 'function') {
+            heartbeat();
+        }
         if (headless) {
             println(status);
         } else {
@@ -42,7 +234,7 @@ function process(progress) {
         }
     }
 
-    let cardFolder = new File(project.getFile(), CARD_FOLDER);
+    let cardFolder = new File(projectFile, CARD_FOLDER);
     ProjectUtilities.deleteAll(cardFolder);
     cardFolder.mkdirs();
     syncProject();
@@ -53,50 +245,189 @@ function process(progress) {
     factory.setExtraSpaceIgnored(false);
     factory.setIgnoreUnknownKeys(true);
     factory.setTemplateClearedForEachRow(true);
-    factory.setOutputFolder(cardFolder);
 
+    // NOTE: The render manifest keeps a hash of what each image was rendered from, that's the CSV row, the template, the language preferences
+    // and the Strange Eons version. Rows with an unchanged hash reuse the image of the previous run instead of being painted again.
+    let manifestFile = new File(projectFile, MANIFEST_FILE);
+    let manifest = manifestFile.exists() ? JSON.parse(ProjectUtilities.getFileText(manifestFile, 'utf-8')) : {};
+    let imageFolder = new File(projectFile, IMAGE_FOLDER);
+    if (imageFolder.exists()) {
+        imageFolder.renameTo(new File(projectFile, IMAGE_FOLDER + '-' + UUID.randomUUID().toString()))
+        imageFolder = new File(projectFile, IMAGE_FOLDER);
+    }
+    // NOTE: The manifest hash is of the most recent render of each card, so look for its image among all previous image folders.
+    let previousImageFiles = {};
+    let projectFiles = projectFile.listFiles();
+    for (let i = 0; i < projectFiles.length; i++) {
+        if (!projectFiles[i].isDirectory() || !projectFiles[i].getName().startsWith(IMAGE_FOLDER + '-')) {
+            continue;
+        }
+        let imageFiles = projectFiles[i].listFiles();
+        for (let j = 0; j < imageFiles.length; j++) {
+            let previousImageFile = previousImageFiles[imageFiles[j].getName()];
+            if (!previousImageFile || imageFiles[j].lastModified() > previousImageFile.lastModified()) {
+                previousImageFiles[imageFiles[j].getName()] = imageFiles[j];
+            }
+        }
+    }
+    imageFolder.mkdirs();
+    syncProject();
+
+    // NOTE: Cards are painted straight from their CSV rows, unless card files are asked for or the script runs in the UI, where the card
+    // files can be opened to inspect what was generated.
+    let optionsFile = new File(projectFile, OPTIONS_FILE);
+    let options = optionsFile.exists() ? JSON.parse(ProjectUtilities.getFileText(optionsFile, 'utf-8')) : {};
+    let writeCardFiles = !headless || options.cardFiles === true;
+    let imageFormatName = options.imageFormat || 'png';
+    let imageFormat = IMAGE_FORMATS[imageFormatName];
+    // NOTE: Cards can be painted at the resolution of their deck slot instead, as the pack step would scale them to that anyway.
+    let ppis = options.ppi || {};
+    // NOTE: Shard bundles carry the portraits of their cards, and map the portrait paths in the CSV rows to the copies within the bundle.
+    let portraitFiles = options.portraits || {};
+    function resolvePortraits(keys, values) {
+        return values.map((value, i) => PORTRAIT_KEY.test(keys[i]) && portraitFiles[value] ? String(new File(projectFile.getParentFile(), portraitFiles[value]).getAbsolutePath()) : value);
+    }
+    let jobs = {};
+
+    let version = String(StrangeEons.getBuildNumber());
+    let preferences = readFileBytes(new File(projectFile, PREFERENCES_FILE));
+    let reused = 0;
+    let rendered = 0;
+    let report = {types: {}, cards: [], memory: [getMemorySnapshot('start')]};
+
+    // NOTE: Keep the cards of each type apart, so that render time can be measured per type.
     for (let i = 0; !progress.cancelled && i < types.length; i++) {
-        let templateFile = new File(project.getFile(), TEMPLATE_FOLDER + '/' + types[i] + '.eon');
-        let template = ResourceKit.getGameComponentFromFile(templateFile, true);
-        let csvFile = new File(project.getFile(), DATA_FOLDER + '/' + types[i] + '.csv');
+        let templateFile = new File(projectFile, TEMPLATE_FOLDER + '/' + types[i] + '.eon');
+        let templateBytes = readFileBytes(templateFile);
+        let templateStart = java.lang.System.nanoTime();
+        let template = loadTemplate(templateFile, templateBytes);
+        report.types[types[i]] = {template: (java.lang.System.nanoTime() - templateStart) / 1e9};
+        let csvFile = new File(projectFile, DATA_FOLDER + '/' + types[i] + '.csv');
         reportStatus(progress, 'Processing ' + csvFile.getName() + '...');
-        let csv = ProjectUtilities.getFileText(csvFile, 'utf-8');
-        factory.process(template, csv);
-        syncProject();
+        let records = splitCsvRecords(String(ProjectUtilities.getFileText(csvFile, 'utf-8')));
+        if (records.length === 0) {
+            continue;
+        }
+        let header = records[0];
+        let fileIndex = getCsvFields(header).indexOf('file');
+        let templateHash = getHash([version, preferences, templateBytes, header]);
+        let changed = [header];
+        for (let j = 1; j < records.length; j++) {
+            let name = getCsvFields(records[j])[fileIndex];
+            let hash = getHash([templateHash, imageFormatName, String(ppis[name] || PPI), records[j]]);
+            let previousImageFile = previousImageFiles[name + imageFormat.extension];
+            if (manifest[name] === hash && previousImageFile) {
+                let imageFile = new File(imageFolder, name + imageFormat.extension);
+                try {
+                    Files.createLink(imageFile.toPath(), previousImageFile.toPath());
+                } catch (e) {
+                    Files.copy(previousImageFile.toPath(), imageFile.toPath());
+                }
+                reused++;
+            } else {
+                manifest[name] = hash;
+                changed.push(records[j]);
+            }
+        }
+        if (changed.length === 1) {
+            continue;
+        }
+        jobs[types[i]] = [];
+        if (writeCardFiles) {
+            let typeFolder = new File(cardFolder, types[i]);
+            typeFolder.mkdirs();
+            factory.setOutputFolder(typeFolder);
+            let keys = getCsvFields(header);
+            let records = changed.map((record, j) => j === 0 ? record : getCsvRecord(resolvePortraits(keys, getCsvFields(record))));
+            factory.process(template, records.join('\n') + '\n');
+            syncProject();
+            let cardFiles = typeFolder.listFiles();
+            for (let j = 0; j < cardFiles.length; j++) {
+                let cardFile = cardFiles[j];
+                jobs[types[i]].push({name: cardFile.getName().replace('.eon', ''), load: () => ResourceKit.getGameComponentFromFile(cardFile, true)});
+            }
+        } else {
+            let keys = getCsvFields(header);
+            for (let j = 1; j < changed.length; j++) {
+                let values = resolvePortraits(keys, getCsvFields(changed[j]));
+                jobs[types[i]].push({name: values[fileIndex], load: () => applyCsvRow(template, keys, values)});
+            }
+        }
     }
 
-    let cardFiles = cardFolder.listFiles();
-    let imageFolder = new File(project.getFile(), IMAGE_FOLDER);
-    if (imageFolder.exists()) {
-        imageFolder.renameTo(new File(project.getFile(), IMAGE_FOLDER + '-' + UUID.randomUUID().toString()))
-        imageFolder = new File(project.getFile(), IMAGE_FOLDER);
+    // NOTE: Cards are rendered type by type, so that each template's resources stay warm, and one image writer is used for all of them.
+    let imageWriter = createImageWriter(imageFormat);
+    let timings = {};
+    for (let t = 0; !progress.cancelled && t < types.length; t++) {
+        if (!jobs[types[t]]) {
+            continue;
+        }
+        let typeJobs = jobs[types[t]];
+        let timing = {count: 0, seconds: 0, load: 0, paint: 0, write: 0};
+        let sheetSeconds = 0;
+        for (let i = 0; !progress.cancelled && i < typeJobs.length; i++) {
+            let start = java.lang.System.nanoTime();
+            let card = typeJobs[i].load();
+            let loaded = java.lang.System.nanoTime();
+            let fields = typeJobs[i].name.split('-');
+            let index = parseInt(fields[fields.length - 1]);
+            let imageFile = new File(imageFolder, typeJobs[i].name + imageFormat.extension);
+            reportStatus(progress, 'Generating ' + imageFile.getName() + '...');
+            let times = {sheet: loaded};
+            let image = paintSheet(card, index, ppis[typeJobs[i].name] || PPI, times);
+            let painted = java.lang.System.nanoTime();
+            imageWriter.write(image, imageFile);
+            let written = java.lang.System.nanoTime();
+            timing.count++;
+            timing.load += (loaded - start) / 1e9;
+            timing.paint += (painted - loaded) / 1e9;
+            timing.write += (written - painted) / 1e9;
+            timing.seconds += (written - start) / 1e9;
+            sheetSeconds += (times.sheet - loaded) / 1e9;
+            report.cards.push({name: typeJobs[i].name, type: types[t], load: (loaded - start) / 1e9, sheet: (times.sheet - loaded) / 1e9,
+                paint: (painted - times.sheet) / 1e9, write: (written - painted) / 1e9});
+            rendered++;
+            syncProject();
+        }
+        timings[types[t]] = timing;
+        // NOTE: The report splits the paint time of timings into sheet creation and painting.
+        report.types[types[t]] = Object.assign(report.types[types[t]], timing, {sheet: sheetSeconds, paint: timing.paint - sheetSeconds});
+        report.memory.push(getMemorySnapshot(types[t]));
+        if (timing.count > 0) {
+            reportStatus(progress, 'Rendered ' + timing.count + ' ' + types[t] + ' cards in ' + timing.seconds.toFixed(1) + 's, '
+                + (timing.load * 1000 / timing.count).toFixed(0) + 'ms load, '
+                + (timing.paint * 1000 / timing.count).toFixed(0) + 'ms paint, '
+                + (timing.write * 1000 / timing.count).toFixed(0) + 'ms write per card...');
+        }
     }
-    imageFolder.mkdirs();
-    syncProject();
+    imageWriter.dispose();
+    reportStatus(progress, 'Rendered ' + rendered + ' cards, reused ' + reused + ' cards...');
 
-    for (let i = 0; !progress.cancelled && i < cardFiles.length; i++) {
-        let cardFile = cardFiles[i];
-        let card = ResourceKit.getGameComponentFromFile(cardFile, true);
-        let cardFilename = cardFile.getName();
-        let fields = cardFilename.replace('.eon', '').split('-');
-        let index = parseInt(fields[fields.length - 1]);
-        let ppi = 300;
-        let synthesizeBleedMargin = false;
-        let imageWriter = new SimpleImageWriter('png');
-        let imageFile = new File(imageFolder, cardFilename.replace('.eon', '.png'));
-        reportStatus(progress, 'Generating ' + imageFile.getName() + '...');
-        let sheets = card.createDefaultSheets();
-        let sheet = sheets[index];
-        let image = sheet.paint(RenderTarget.EXPORT, ppi, synthesizeBleedMargin);
-        imageWriter.write(image, imageFile);
-        syncProject();
+    // NOTE: Only record the manifest when the run completes, a cancelled run leaves hashes of cards that were never painted.
+    if (!progress.cancelled) {
+        let manifestWriter = new OutputStreamWriter(new FileOutputStream(manifestFile), 'utf-8');
+        manifestWriter.write(JSON.stringify(manifest));
+        manifestWriter.close();
     }
+
+    let writer = new OutputStreamWriter(new FileOutputStream(new File(projectFile, TIMING_FILE)), 'utf-8');
+    writer.write(JSON.stringify(timings));
+    writer.close();
+
+    report.reused = reused;
+    report.memory.push(getMemorySnapshot('end'));
+    let reportWriter = new OutputStreamWriter(new FileOutputStream(new File(projectFile, REPORT_FILE)), 'utf-8');
+    reportWriter.write(JSON.stringify(report));
+    reportWriter.close();
 }
 
-if (headless) {
-    process({cancelled: false});
-    project.close();
-} else {
-    Thread.busyWindow(process, 'Building...', true);
+// NOTE: serve.js runs this script for its functions only.
+if (typeof SERVICE === 'undefined') {
+    if (headless) {
+        process({cancelled: false}, project.getFile());
+        project.close();
+    } else {
+        Thread.busyWindow(progress => process(progress, project.getFile()), 'Building...', true);
+    }
 }
 
@@ -0,0 +1,60 @@
+const QUEUE_FOLDER = 'SE_Generator/queue';
+const POLL_MILLIS = 500;
+
+// NOTE: Load the functions and imports of make.js without running it, each job is rendered by its process function.
+var SERVICE = true;
+(0, eval)(String(arkham.project.ProjectUtilities.getFileText(new java.io.File('SE_Generator/make.js'), 'utf-8')));
+
+let queueFolder = new File(QUEUE_FOLDER);
+let heartbeatFile = new File(queueFolder, 'heartbeat');
+let stopFile = new File(queueFolder, 'stop');
+
+function heartbeat() {
+    if (!heartbeatFile.exists()) {
+        heartbeatFile.createNewFile();
+    }
+    heartbeatFile.setLastModified(java.lang.System.currentTimeMillis());
+}
+
+function writeText(file, text) {
+    let writer = new OutputStreamWriter(new FileOutputStream(file), 'utf-8');
+    writer.write(text);
+    writer.close();
+}
+
+// NOTE: A job is a local shard bundle in a subfolder of the queue, marked as queued by main.py and marked as done once its images are written.
+// The queued marker is renamed to claim a job, main.py does the same before rendering a job itself, so a job is only rendered once.
+function getQueuedJobs() {
+    let jobs = [];
+    let queueFiles = queueFolder.listFiles() || [];
+    for (let i = 0; i < queueFiles.length; i++) {
+        let bundleFolders = queueFiles[i].isDirectory() ? queueFiles[i].listFiles() : [];
+        for (let j = 0; j < bundleFolders.length; j++) {
+            if (new File(bundleFolders[j], 'queued').exists()) {
+                jobs.push(bundleFolders[j]);
+            }
+        }
+    }
+    return jobs;
+}
+
+println('Waiting for render jobs in ' + QUEUE_FOLDER + '...');
+while (!stopFile.exists()) {
+    heartbeat();
+    let jobs = getQueuedJobs();
+    for (let i = 0; i < jobs.length && !stopFile.exists(); i++) {
+        if (!new File(jobs[i], 'queued').renameTo(new File(jobs[i], 'claimed'))) {
+            continue;
+        }
+        println('Rendering ' + jobs[i].getPath() + '...');
+        try {
+            process({cancelled: false}, new File(jobs[i], PROJECT_FOLDER));
+        } catch (e) {
+            writeText(new File(jobs[i], 'error'), String(e));
+        }
+        writeText(new File(jobs[i], 'done'), '');
+    }
+    java.lang.Thread.sleep(POLL_MILLIS);
+}
+stopFile.delete();
+heartbeatFile.delete();
@@ -18,14 +18,21 @@ import base64
 import requests
 import inspect
 import importlib
-import urllib.request
+import concurrent.futures
 import time
 import dropbox
 import uuid
 import glob
 import copy
+import textwrap
+import math
+import heapq
+import tempfile
+import hashlib
+import io
 import warnings
-from PIL import Image
+import numpy
+from PIL import Image, ImageDraw, ImageFont
 from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning
 # Suppress BeautifulSoup useless warnings.
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
@@ -38,6 +45,7 @@ parser.add_argument('--lang', default='zh_CN', choices=langs, help='The language
 parser.add_argument('--se-executable', default=r'C:\Program Files\StrangeEons\bin\eons.exe', help='The Strange Eons executable path')
 parser.add_argument('--se-preferences', default=fr'{os.getenv("APPDATA")}\StrangeEons3\preferences', help='The Strange Eons preferences file path')
 parser.add_argument('--filter', default='True', help='A Python expression filter for what cards to process')
+parser.add_argument('--select', action='append', default=[], help='A card text selector for what cards to process, e.g. "[[Elite]]" or "back_text:[seal_f]", can be repeated')
 parser.add_argument('--repo-dir', default='repos', help='The directory to keep intermediate repositories during processing')
 parser.add_argument('--cache-dir', default='cache', help='The directory to keep intermediate resources during processing')
 parser.add_argument('--decks-dir', default='decks', help='The directory to keep translated deck images')
@@ -47,6 +55,30 @@ parser.add_argument('--mod-dir-secondary', default='repos/loadable-objects', hel
 parser.add_argument('--url-file', default='cache/urls.json', help='The file to keep the url mapping')
 parser.add_argument('--dropbox-token', default=None, help='The dropbox token for uploading translated deck images')
 parser.add_argument('--new-link', action='store_true', help='Whether to create new URL while uploading deck images')
+parser.add_argument('--render-untranslated', action='store_true', help='Whether to generate card faces whose text has no translation, instead of keeping the original faces')
+parser.add_argument('--incremental', action='store_true', help='Whether to only generate, pack and upload cards affected by changes since the last upload')
+parser.add_argument('--download-workers', type=int, default=8, help='The number of concurrent deck image downloads')
+parser.add_argument('--download-retries', type=int, default=3, help='The number of times to retry a failed deck image download')
+parser.add_argument('--crop-workers', type=int, default=os.cpu_count(), help='The number of threads used to save cropped card images')
+parser.add_argument('--crop-format', default='png', choices=['png', 'png-fast', 'webp', 'tiles'], help='The format to keep cropped card images in the cache')
+parser.add_argument('--prescale-portraits', action='store_true', help='Whether to hand Strange Eons card portraits already reduced to the template size at render resolution')
+parser.add_argument('--renderer', default='strange-eons', choices=['strange-eons', 'pillow'], help='The renderer to generate card images with, pillow is a stand-in for Strange Eons for benchmarking')
+parser.add_argument('--se-workers', type=int, default=1, help='The number of Strange Eons processes to render card images in parallel')
+parser.add_argument('--se-service', action='store_true', help='Whether to run a Strange Eons render service, which the generate step hands render jobs to while it is running')
+parser.add_argument('--shards-dir', default='shards', help='The directory to keep shard bundles for rendering on other machines')
+parser.add_argument('--export-shards', type=int, default=0, help='The number of shard bundles to export for rendering on other machines, instead of rendering card images')
+parser.add_argument('--import-shards', action='store_true', help='Whether to import card images rendered from shard bundles, instead of rendering card images')
+parser.add_argument('--pack-workers', type=int, default=os.cpu_count(), help='The number of processes to pack deck images in parallel')
+parser.add_argument('--pack-memory', type=int, default=2048, help='The memory budget in MB for deck images being packed at the same time')
+parser.add_argument('--deck-quality-metric', default=None, choices=['ssim', 'psnr'], help='The perceptual metric to search for the lowest JPEG quality of each deck image with, instead of the default quality')
+parser.add_argument('--deck-quality-target', type=float, default=None, help='The lowest metric value of deck images against their unencoded versions, 0.98 for ssim and 40 for psnr by default')
+parser.add_argument('--deck-quality-budget', type=float, default=10, help='The time for searching the JPEG quality of a deck image, in multiples of the time to encode it at the default quality')
+parser.add_argument('--stream-pack', action='store_true', help='Whether to pack each deck image as soon as its card images are rendered')
+parser.add_argument('--se-card-files', action='store_true', help='Whether to save a Strange Eons card file for each generated card, for inspecting in the Strange Eons UI')
+parser.add_argument('--se-image-format', default='png', choices=['png', 'png-fast', 'tiff'], help='The format of card images handed from Strange Eons to the pack step')
+parser.add_argument('--se-render-slot-size', action='store_true', help='Whether to render card images at the size of their deck slot instead of at 300 ppi')
+parser.add_argument('--benchmark', default=None, choices=['crop', 'handoff'], help='Run a benchmark with the cached data instead of the automation steps')
+parser.add_argument('--benchmark-samples', type=int, default=10, help='The number of deck images to benchmark with')
 parser.add_argument('--step', default=None, choices=steps, help='The particular automation step to run')
 args = parser.parse_args()
 
@@ -77,7 +109,64 @@ def transform_lang(value):
     attr = inspect.stack()[1].function.replace('get_se_', '')
     func_name = f'transform_{attr}'
     func = getattr(module, func_name, None)
-    return func(value) if func else value
+    if not func:
+        return value
+    result = func(value)
+    if value or result != value:
+        trace_rule(f'transform:{func_name}')
+    return result
+
+# NOTE: While a row is being built, this is the set of markup rules and transform functions that actually changed its text.
+rule_trace = None
+def trace_rule(name):
+    if rule_trace is not None:
+        rule_trace.add(name)
+
+def apply_rule(name, pattern, replacement, text, flags=0):
+    text, count = re.subn(pattern, replacement, text, flags=flags)
+    if count:
+        trace_rule(name)
+    return text
+
+def get_function_fingerprint(func):
+    # NOTE: Include the source of module level helper functions called by the function, so that a change in a shared helper affects all its callers.
+    sources = []
+    seen = set()
+    pending = [func]
+    while pending:
+        func = pending.pop()
+        if func in seen:
+            continue
+        seen.add(func)
+        sources.append(inspect.getsource(func))
+        for name in func.__code__.co_names:
+            value = func.__globals__.get(name)
+            if inspect.isfunction(value) and value.__globals__ is func.__globals__:
+                pending.append(value)
+    return hashlib.sha1('\n'.join(sorted(sources)).encode('utf-8')).hexdigest()[:12]
+
+def get_rule_fingerprint(pattern, replacement, flags=0):
+    return hashlib.sha1(f'{pattern}\n{replacement}\n{int(flags)}'.encode('utf-8')).hexdigest()[:12]
+
+rule_fingerprints = None
+def get_rule_fingerprints():
+    global rule_fingerprints
+    if rule_fingerprints is not None:
+        return rule_fingerprints
+    fingerprints = {}
+    for a, b in se_markup:
+        fingerprints[f'markup:{a}'] = get_rule_fingerprint(a, b, re.I)
+    for name, a, b in se_rule_cleanup + [se_rule_bullet]:
+        fingerprints[f'rule:{name}'] = get_rule_fingerprint(a, b)
+    for func in [get_se_markup, get_se_rule, get_se_paragraph_line]:
+        fingerprints[f'function:{func.__name__}'] = get_function_fingerprint(func)
+    module = import_lang_module()
+    if module:
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if name.startswith('transform_'):
+                fingerprints[f'transform:{name}'] = get_function_fingerprint(func)
+    rule_fingerprints = fingerprints
+    return rule_fingerprints
 
 # NOTE: ADB data may contain explicit null fields, that should be treated the same as missing.
 def get_field(card, key, default):
@@ -1068,56 +1157,69 @@ def get_se_traits(card):
     traits = ' '.join(traits)
     return transform_lang(traits)
 
-def get_se_markup(rule):
-    markup = [
-        (r'\[action\]', '<act>'),
-        (r'\[reaction\]', '<rea>'),
-        (r'\[free\]', '<fre>'),
-        (r'\[fast\]', '<fre>'),
-        (r'\[willpower\]', '<wil>'),
-        (r'\[intellect\]', '<int>'),
-        (r'\[combat\]', '<com>'),
-        (r'\[agility\]', '<agi>'),
-        (r'\[wild\]', '<wild>'),
-        (r'\[guardian\]', '<gua>'),
-        (r'\[seeker\]', '<see>'),
-        (r'\[rogue\]', '<rog>'),
-        (r'\[mystic\]', '<mys>'),
-        (r'\[survivor\]', '<sur>'),
-        (r'\[skull\]', '<sku>'),
-        (r'\[cultist\]', '<cul>'),
-        (r'\[tablet\]', '<tab>'),
-        (r'\[elder_thing\]', '<mon>'),
-        (r'\[elder_sign\]', '<eld>'),
-        (r'\[auto_fail\]', '<ten>'),
-        (r'\[bless\]', '<ble>'),
-        (r'\[curse\]', '<cur>'),
-        (r'\[per_investigator\]', '<per>'),
-        (r'\[frost\]', '<fro>'),
-        (r'\[seal_a\]', '<seal1>'),
-        (r'\[seal_b\]', '<seal2>'),
-        (r'\[seal_c\]', '<seal3>'),
-        (r'\[seal_d\]', '<seal4>'),
-        (r'\[seal_e\]', '<seal5>'),
-    ]
-    for a, b in markup:
-        rule = re.sub(a, b, rule, flags=re.I)
+se_markup = [
+    (r'\[action\]', '<act>'),
+    (r'\[reaction\]', '<rea>'),
+    (r'\[free\]', '<fre>'),
+    (r'\[fast\]', '<fre>'),
+    (r'\[willpower\]', '<wil>'),
+    (r'\[intellect\]', '<int>'),
+    (r'\[combat\]', '<com>'),
+    (r'\[agility\]', '<agi>'),
+    (r'\[wild\]', '<wild>'),
+    (r'\[guardian\]', '<gua>'),
+    (r'\[seeker\]', '<see>'),
+    (r'\[rogue\]', '<rog>'),
+    (r'\[mystic\]', '<mys>'),
+    (r'\[survivor\]', '<sur>'),
+    (r'\[skull\]', '<sku>'),
+    (r'\[cultist\]', '<cul>'),
+    (r'\[tablet\]', '<tab>'),
+    (r'\[elder_thing\]', '<mon>'),
+    (r'\[elder_sign\]', '<eld>'),
+    (r'\[auto_fail\]', '<ten>'),
+    (r'\[bless\]', '<ble>'),
+    (r'\[curse\]', '<cur>'),
+    (r'\[per_investigator\]', '<per>'),
+    (r'\[frost\]', '<fro>'),
+    (r'\[seal_a\]', '<seal1>'),
+    (r'\[seal_b\]', '<seal2>'),
+    (r'\[seal_c\]', '<seal3>'),
+    (r'\[seal_d\]', '<seal4>'),
+    (r'\[seal_e\]', '<seal5>'),
     # NOTE: Format traits. We avoid the buggy behavior of </size> in SE instead we set font size by relative percentage, 0.9 * 0.33 * 3.37 = 1.00089.
-    rule = re.sub(r'\[\[([^\]]*)\]\]', r'<size 90%><t>\1</t><size 33%> <size 337%>', rule)
+    (r'\[\[([^\]]*)\]\]', r'<size 90%><t>\1</t><size 33%> <size 337%>'),
+]
+
+def get_se_markup(rule):
+    trace_rule('function:get_se_markup')
+    for a, b in se_markup:
+        rule = apply_rule(f'markup:{a}', a, b, rule, re.I)
     return rule
 
-def get_se_rule(rule):
-    rule = get_se_markup(rule)
+se_rule_cleanup = [
     # NOTE: Get rid of the errata text, e.g. Wendy's Amulet.
-    rule = re.sub(r'<i>\(Errat(um|a)[^<]*</i>', '', rule)
+    ('errata', r'<i>\(Errat(um|a)[^<]*</i>', ''),
     # NOTE: Get rid of the FAQ text, e.g. Rex Murphy.
-    rule = re.sub(r'<i>\(FAQ[^<]*</i>', '', rule)
+    ('faq', r'<i>\(FAQ[^<]*</i>', ''),
     # NOTE: Format bold action keywords.
-    rule = re.sub(r'<b>([^<]*)</b>', r'<size 95%><hdr>\1</hdr><size 105%>', rule)
+    ('bold', r'<b>([^<]*)</b>', r'<size 95%><hdr>\1</hdr><size 105%>'),
     # NOTE: Convert <p> tag to newline characters.
-    rule = rule.replace('</p><p>', '\n').replace('<p>', '').replace('</p>', '')
-    # NOTE: Format bullet icon at the start of the line.
-    rule = '\n'.join([re.sub(r'^[\-—] ', '<bul> ', line.strip()) for line in rule.split('\n')])
+    ('paragraph', r'</p><p>', '\n'),
+    ('paragraph_open', r'<p>', ''),
+    ('paragraph_close', r'</p>', ''),
+]
+
+# NOTE: Format bullet icon at the start of the line.
+se_rule_bullet = ('bullet', r'^[\-—] ', '<bul> ')
+
+def get_se_rule(rule):
+    trace_rule('function:get_se_rule')
+    rule = get_se_markup(rule)
+    for name, a, b in se_rule_cleanup:
+        rule = apply_rule(f'rule:{name}', a, b, rule)
+    name, a, b = se_rule_bullet
+    rule = '\n'.join([apply_rule(f'rule:{name}', a, b, line.strip()) for line in rule.split('\n')])
     # NOTE: We intentionally add a space at the end to hack around a problem with SE scenario card layout. If we don't add this space,
     # the text on scenario cards doesn't automatically break lines.
     rule = f'{rule} ' if rule.strip() else ''
@@ -1251,6 +1353,9 @@ def get_se_back_header(card):
     return get_se_header(header)
 
 def get_se_paragraph_line(card, text, flavor, index):
+    if text or flavor:
+        trace_rule('function:get_se_paragraph_line')
+
     # NOTE: Header is determined by 'b' tag ending with colon or followed by a newline (except for resolution text).
     def is_header(elem):
         if elem.name == 'b':
@@ -1615,7 +1720,7 @@ def download_repo(repo_folder, repo):
     return repo_folder
 
 ahdb = {}
-def download_card(ahdb_id):
+def load_cards():
     ahdb_folder = f'{args.cache_dir}/ahdb'
     ensure_dir(ahdb_folder)
     lang_code, _ = get_lang_code_region()
@@ -1702,6 +1807,7 @@ def download_card(ahdb_id):
             pf_card['code'] = pfid
             pf_card['back_text'] = get_field(old_card, 'back_text', '')
             pf_card['back_flavor'] = get_field(old_card, 'back_flavor', '')
+            copy_translation_sources(pf_card, old_card, ['back_text', 'back_flavor'])
             ahdb[pfid] = pf_card
 
             pbid = f'{old_id}-pb'
@@ -1718,6 +1824,7 @@ def download_card(ahdb_id):
             pb_card['skill_intellect'] = get_field(old_card, 'skill_intellect', 0)
             pb_card['skill_combat'] = get_field(old_card, 'skill_combat', 0)
             pb_card['skill_agility'] = get_field(old_card, 'skill_agility', 0)
+            copy_translation_sources(pb_card, old_card, ['text', 'flavor'])
             ahdb[pbid] = pb_card
 
         # NOTE: Patching special point attributes as separate fields.
@@ -1734,7 +1841,241 @@ def download_card(ahdb_id):
                 card[point_key] = point
                 card['text'] = re.sub(re_point, '', card['text'])
 
-    return ahdb[ahdb_id]
+    return ahdb
+
+def download_card(ahdb_id):
+    return load_cards()[ahdb_id]
+
+# NOTE: The card text fields shown on each face. The English value of a translated field is kept as 'real_*', see 'load_cards'.
+translation_face_fields = {
+    True: ['name', 'subname', 'traits', 'text', 'flavor'],
+    False: ['name', 'subname', 'back_name', 'back_text', 'back_flavor'],
+}
+
+def copy_translation_sources(card, source_card, keys):
+    # NOTE: Fields copied from another card must keep that card's English value as well, or they would look translated or untranslated wrongly.
+    for key in keys:
+        if f'real_{key}' in source_card:
+            card[f'real_{key}'] = source_card[f'real_{key}']
+        else:
+            card.pop(f'real_{key}', None)
+
+def get_translation_coverage(card, is_front):
+    # NOTE: A field is translated when its English value differs, fields left empty on the card don't count either way.
+    coverage = {}
+    for field in translation_face_fields[is_front]:
+        value = get_field(card, field, '')
+        if value:
+            coverage[field] = f'real_{field}' in card and value != card[f'real_{field}']
+    return coverage
+
+translation_coverage = {}
+def is_face_translated(card, is_front):
+    coverage = get_translation_coverage(card, is_front)
+    translation_coverage.setdefault(card['code'], {}).update(coverage)
+    # NOTE: A face without any text is still generated, e.g. for its encounter set or pack icon.
+    return args.render_untranslated or not coverage or any(coverage.values())
+
+def write_translation_coverage():
+    ensure_dir(f'{args.cache_dir}/coverage')
+    with open(f'{args.cache_dir}/coverage/{args.lang}.json', 'w', encoding='utf-8') as file:
+        json_str = json.dumps(translation_coverage, indent=2, sort_keys=True)
+        file.write(json_str)
+
+index_fields = ['text', 'back_text', 'flavor', 'back_flavor', 'traits']
+
+def get_index_tokens(text, field):
+    tokens = set()
+    # NOTE: Trait markup and icon markup are indexed with their brackets so that selectors like '[[Elite]]' or '[seal_f]' can target them precisely.
+    for trait in re.findall(r'\[\[([^\]]*)\]\]', text):
+        tokens.add(f'[[{trait.strip().casefold()}]]')
+    for icon in re.findall(r'(?<!\[)\[([a-z_]+)\](?!\])', text, flags=re.I):
+        tokens.add(f'[{icon.lower()}]')
+    # NOTE: The traits field is a list of bare trait names, index them the same way as trait markup in the text.
+    if field == 'traits':
+        for trait in text.split('.'):
+            if trait.strip():
+                tokens.add(f'[[{trait.strip().casefold()}]]')
+    text = re.sub(r'<[^>]*>', ' ', text)
+    text = re.sub(r'(?<!\[)\[[a-z_]+\](?!\])', ' ', text, flags=re.I)
+    tokens.update(word.casefold() for word in re.findall(r'\w+', text))
+    return tokens
+
+text_index = None
+def load_text_index():
+    global text_index
+    if text_index is not None:
+        return text_index
+
+    cards = load_cards()
+    lang_code, _ = get_lang_code_region()
+    card_filenames = [f'{args.cache_dir}/ahdb/{lang_code}.json', f'translations/{lang_code}/taboo.json']
+    filename = f'{args.cache_dir}/ahdb/{lang_code}_index.json'
+    # NOTE: The index is built together with the card cache, and rebuilt whenever any of the card data it's built from is newer.
+    if os.path.isfile(filename) and all(os.path.getmtime(filename) >= os.path.getmtime(card_filename) for card_filename in card_filenames):
+        with open(filename, 'r', encoding='utf-8') as file:
+            text_index = json.loads(file.read())
+        return text_index
+
+    print(f'Indexing ArkhamDB data...')
+    text_index = {}
+    for ahdb_id, card in cards.items():
+        for field in index_fields:
+            for token in get_index_tokens(get_field(card, field, ''), field):
+                text_index.setdefault(token, {}).setdefault(ahdb_id, []).append(field)
+    with open(filename, 'w', encoding='utf-8') as file:
+        json_str = json.dumps(text_index, ensure_ascii=False, sort_keys=True)
+        file.write(json_str)
+    return text_index
+
+def resolve_selector(selector):
+    # NOTE: A selector is a piece of card text optionally prefixed by a field name, e.g. '[[Elite]]' or 'back_text:[seal_f]'. A card is selected if it contains all tokens of the text.
+    fields = index_fields
+    field, sep, text = selector.partition(':')
+    if sep and field in index_fields:
+        fields = [field]
+    else:
+        text = selector
+    index = load_text_index()
+    ahdb_ids = None
+    for token in get_index_tokens(text, None):
+        postings = index.get(token, {})
+        token_ids = set(ahdb_id for ahdb_id, token_fields in postings.items() if any(token_field in fields for token_field in token_fields))
+        ahdb_ids = token_ids if ahdb_ids is None else ahdb_ids & token_ids
+    return ahdb_ids or set()
+
+selected_ids = None
+def is_selected(card):
+    global selected_ids
+    if not args.select:
+        return True
+    if selected_ids is None:
+        selected_ids = set.intersection(*[resolve_selector(selector) for selector in args.select])
+    # NOTE: SCED objects refer to the front card id, so also select the object if its linked back card matches.
+    if 'linked_card' in card and card['linked_card']['code'] in selected_ids:
+        return True
+    return card['code'] in selected_ids
+
+result_map = None
+def read_result_map():
+    global result_map
+    filename = f'{args.cache_dir}/results.json'
+    if result_map is None:
+        result_map = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                result_map = json.loads(file.read())
+    return result_map
+
+def write_result_map():
+    ensure_dir(args.cache_dir)
+    if result_map is not None:
+        with open(f'{args.cache_dir}/results.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(result_map, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def add_result_id(ahdb_id, result_id):
+    result_map = read_result_map()
+    result_ids = result_map.setdefault(ahdb_id, [])
+    if result_id not in result_ids:
+        result_ids.append(result_id)
+
+def report_selection():
+    start = time.perf_counter()
+    load_text_index()
+    load_start = time.perf_counter()
+    ahdb_ids = set.intersection(*[resolve_selector(selector) for selector in args.select])
+    result_map = read_result_map()
+    result_ids = set()
+    for ahdb_id in ahdb_ids:
+        result_ids.update(result_map.get(ahdb_id, []))
+    deck_url_ids = set(decode_result_id(result_id)[0] for result_id in result_ids)
+    elapsed = (time.perf_counter() - load_start) * 1000
+    print(f'Selected {len(ahdb_ids)} cards, {len(result_ids)} results in {len(deck_url_ids)} decks ({elapsed:.1f}ms after {(load_start - start) * 1000:.1f}ms loading)')
+    for deck_url_id in sorted(deck_url_ids):
+        print(f'    {deck_url_id}')
+
+rule_manifest = None
+# NOTE: The rows recorded in this run, so that rows for cards no longer in the mod can be told apart when the manifest is written.
+recorded_result_ids = set()
+def read_rule_manifest():
+    global rule_manifest
+    filename = f'{args.cache_dir}/rules/{args.lang}.json'
+    if rule_manifest is None:
+        rule_manifest = {'rows': {}, 'dirty': [], 'skipped': []}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                rule_manifest = json.loads(file.read())
+        rule_manifest['dirty'] = set(rule_manifest['dirty'])
+        rule_manifest['skipped'] = set(rule_manifest.get('skipped', []))
+    return rule_manifest
+
+def write_rule_manifest():
+    ensure_dir(f'{args.cache_dir}/rules')
+    if rule_manifest is not None:
+        # NOTE: Only a run translating every card can tell that a card is gone, a filtered run leaves the rows of other cards alone.
+        if recorded_result_ids and args.filter == 'True' and not args.select:
+            rule_manifest['rows'] = {result_id: row for result_id, row in rule_manifest['rows'].items() if result_id in recorded_result_ids}
+        with open(f'{args.cache_dir}/rules/{args.lang}.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps({**rule_manifest, 'dirty': sorted(rule_manifest['dirty']), 'skipped': sorted(rule_manifest['skipped'])}, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def get_row_hash(component):
+    return hashlib.sha1(json.dumps(component, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def get_changed_rules(row, fingerprints):
+    return [name for name, fingerprint in row['rules'].items() if fingerprints.get(name) != fingerprint]
+
+def report_changed_rules():
+    # NOTE: Work out the rows affected by code changes from the previous run alone, before anything is translated again.
+    manifest = read_rule_manifest()
+    fingerprints = get_rule_fingerprints()
+    changed_rules = set()
+    result_ids = []
+    for result_id, row in manifest['rows'].items():
+        row_changed_rules = get_changed_rules(row, fingerprints)
+        if row_changed_rules:
+            changed_rules.update(row_changed_rules)
+            result_ids.append(result_id)
+    if changed_rules:
+        print(f'Changed {len(changed_rules)} rules affecting {len(result_ids)} rows:')
+        for name in sorted(changed_rules):
+            print(f'    {name}')
+
+def record_rule_row(result_id, component, rules):
+    manifest = read_rule_manifest()
+    fingerprints = get_rule_fingerprints()
+    row_hash = get_row_hash(component)
+    old_row = manifest['rows'].get(result_id)
+    # NOTE: A row needs to be rebuilt if it's new, its content changed, or any rule that fired for it previously has changed since.
+    if old_row is None or old_row['hash'] != row_hash or get_changed_rules(old_row, fingerprints):
+        manifest['dirty'].add(result_id)
+    manifest['skipped'].discard(result_id)
+    recorded_result_ids.add(result_id)
+    manifest['rows'][result_id] = {
+        'hash': row_hash,
+        'rules': {name: fingerprints[name] for name in sorted(rules) if name in fingerprints},
+    }
+
+def record_skipped_result(result_id):
+    # NOTE: A face skipped for having no translation keeps the original face in its deck image. Its deck needs packing again if the face was
+    # generated before, and the row is forgotten so that the face counts as new once it's translated.
+    manifest = read_rule_manifest()
+    if result_id not in manifest['skipped']:
+        manifest['skipped'].add(result_id)
+        manifest['dirty'].add(result_id)
+    manifest['rows'].pop(result_id, None)
+
+def get_skipped_results():
+    return read_rule_manifest()['skipped']
+
+def is_dirty_result(result_id):
+    return result_id in read_rule_manifest()['dirty']
+
+def clean_dirty_results(deck_url_ids):
+    manifest = read_rule_manifest()
+    manifest['dirty'] = set(result_id for result_id in manifest['dirty'] if decode_result_id(result_id)[0] not in deck_url_ids)
+    write_rule_manifest()
 
 url_map = None
 def read_url_map():
@@ -1751,6 +2092,9 @@ def read_url_map():
     for lang, url_set in url_map.items():
         for url_id, url in url_set.items():
             url_id_map[url] = url_id
+    # NOTE: Aliases are other urls of an already known English deck image, e.g. after the deck is re-hosted.
+    for url, url_id in read_url_aliases().items():
+        url_id_map[url] = url_id
 
     return url_map, url_id_map
 
@@ -1761,10 +2105,8 @@ def write_url_map():
             json_str = json.dumps(url_map, indent=2, sort_keys=True)
             file.write(json_str)
 
-def get_en_url_id(url):
-    url_map, url_id_map = read_url_map()
-    if url in url_id_map:
-        return url_id_map[url]
+def add_en_url(url):
+    url_map, _ = read_url_map()
     url_id = str(uuid.uuid4()).replace('-', '')
     if 'en' not in url_map:
         url_map['en'] = {}
@@ -1772,6 +2114,35 @@ def get_en_url_id(url):
     write_url_map()
     return url_id
 
+url_aliases = None
+def read_url_aliases():
+    global url_aliases
+    filename = f'{args.cache_dir}/url_aliases.json'
+    if url_aliases is None:
+        url_aliases = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                url_aliases = json.loads(file.read())
+    return url_aliases
+
+def write_url_aliases():
+    ensure_dir(args.cache_dir)
+    if url_aliases is not None:
+        with open(f'{args.cache_dir}/url_aliases.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(url_aliases, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def add_en_url_alias(url, url_id):
+    read_url_aliases()[url] = url_id
+    write_url_aliases()
+
+def get_en_url_id(url):
+    # NOTE: New urls are matched against the known deck images by 'resolve_en_url_ids' when translating, any other url gets a new url id.
+    _, url_id_map = read_url_map()
+    if url in url_id_map:
+        return url_id_map[url]
+    return add_en_url(url)
+
 def set_url_id(url_id, url):
     url_map, _ = read_url_map()
     if args.lang not in url_map:
@@ -1786,33 +2157,542 @@ def decode_result_id(result_id):
     parts = result_id.split('-')
     return parts[0], int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4]), bool(int(parts[5])), int(parts[6])
 
-def download_deck_image(url):
+http_session = None
+def get_http_session():
+    global http_session
+    if http_session is None:
+        # NOTE: Share one session between download threads so that connections to the same image host are pooled and reused.
+        http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=args.download_workers, pool_maxsize=args.download_workers)
+        http_session.mount('http://', adapter)
+        http_session.mount('https://', adapter)
+    return http_session
+
+def is_deck_image_valid(filename):
+    # NOTE: Only decoding the whole image tells a truncated file apart from one with trailing metadata or padding after its last marker.
+    try:
+        with Image.open(filename) as image:
+            image.load()
+        return True
+    except Exception:
+        return False
+
+def fetch_deck_image(url, filename):
+    session = get_http_session()
+    # NOTE: Download to a temporary file first and only move it to the final path once complete and verified, so that an interrupted download is never reused.
+    temp_filename = f'{filename}.part'
+    for attempt in range(args.download_retries + 1):
+        try:
+            offset = os.path.getsize(temp_filename) if os.path.isfile(temp_filename) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            with session.get(url, headers=headers, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                # NOTE: Resume a partial download only if the server honors the range request, otherwise start over.
+                mode = 'ab' if offset and response.status_code == 206 else 'wb'
+                with open(temp_filename, mode) as file:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        file.write(chunk)
+            if not is_deck_image_valid(temp_filename):
+                os.remove(temp_filename)
+                raise ValueError('Invalid image data')
+            os.replace(temp_filename, filename)
+            return filename
+        except Exception as e:
+            # NOTE: A range that can't be satisfied means the partial file is stale, start over on the next attempt.
+            if isinstance(e, requests.HTTPError) and e.response.status_code == 416 and os.path.isfile(temp_filename):
+                os.remove(temp_filename)
+            if attempt == args.download_retries:
+                raise
+            delay = 2 ** attempt
+            print(f'Retrying {os.path.basename(filename)} in {delay}s ({e})...')
+            time.sleep(delay)
+
+def get_cached_deck_image_filename(url_id):
+    return f'{args.cache_dir}/decks/{url_id}.jpg'
+
+verified_deck_images = None
+def read_verified_deck_images():
+    global verified_deck_images
+    filename = f'{args.cache_dir}/verified_decks.json'
+    if verified_deck_images is None:
+        verified_deck_images = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                verified_deck_images = json.loads(file.read())
+    return verified_deck_images
+
+def write_verified_deck_images():
+    ensure_dir(args.cache_dir)
+    if verified_deck_images is not None:
+        with open(f'{args.cache_dir}/verified_decks.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(verified_deck_images, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def record_verified_deck_image(filename):
+    stat = os.stat(filename)
+    read_verified_deck_images()[os.path.basename(filename)] = [stat.st_size, stat.st_mtime_ns]
+
+def is_cached_deck_image_valid(filename):
+    # NOTE: Decoding a whole deck image is slow, so a cached file is only decoded once, and again if its size or modification time changes.
+    stat = os.stat(filename)
+    if read_verified_deck_images().get(os.path.basename(filename)) == [stat.st_size, stat.st_mtime_ns]:
+        return True
+    if not is_deck_image_valid(filename):
+        return False
+    record_verified_deck_image(filename)
+    return True
+
+def download_deck_images(urls):
     decks_folder = f'{args.cache_dir}/decks'
     ensure_dir(decks_folder)
-    url_id = get_en_url_id(url)
-    filename = f'{decks_folder}/{url_id}.jpg'
-    if not os.path.isfile(filename):
-        print(f'Downloading {url_id}.jpg...')
-        urllib.request.urlretrieve(url, filename)
-    return filename
+    filenames = {}
+    pending = []
+    for url in dict.fromkeys(urls):
+        url_id = get_en_url_id(url)
+        filename = get_cached_deck_image_filename(url_id)
+        filenames[url] = filename
+        if not os.path.isfile(filename) or not is_cached_deck_image_valid(filename):
+            pending.append((url, filename))
+
+    # NOTE: Downloaded files are decoded in full by 'fetch_deck_image' before they're moved into place.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.download_workers) as executor:
+        futures = {executor.submit(fetch_deck_image, url, filename): filename for url, filename in pending}
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            future.result()
+            record_verified_deck_image(futures[future])
+            print(f'Downloaded {os.path.basename(futures[future])} ({i + 1}/{len(futures)})...')
+    write_verified_deck_images()
+    return filenames
+
+deck_fingerprints = None
+def read_deck_fingerprints():
+    global deck_fingerprints
+    filename = f'{args.cache_dir}/decks.json'
+    if deck_fingerprints is None:
+        deck_fingerprints = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                deck_fingerprints = json.loads(file.read())
+    return deck_fingerprints
+
+def write_deck_fingerprints():
+    ensure_dir(args.cache_dir)
+    if deck_fingerprints is not None:
+        with open(f'{args.cache_dir}/decks.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(deck_fingerprints, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def get_deck_thumbnail(filename):
+    with Image.open(filename) as deck_image:
+        # NOTE: Let the JPEG decoder downscale while decoding, which is much faster than decoding the full deck image.
+        deck_image.draft('L', (deck_image.width // 8, deck_image.height // 8))
+        return deck_image.convert('L').resize((256, 256), Image.Resampling.BILINEAR)
+
+def get_deck_fingerprint(filename):
+    with open(filename, 'rb') as file:
+        content_hash = hashlib.sha256(file.read()).hexdigest()
+    with Image.open(filename) as deck_image:
+        size = list(deck_image.size)
+    return {'sha256': content_hash, 'phash': get_perceptual_hashes([get_deck_thumbnail(filename)])[0], 'size': size}
+
+def find_matching_deck(fingerprint, filename):
+    fingerprints = read_deck_fingerprints()
+    for url_id, known in fingerprints.items():
+        if known['sha256'] == fingerprint['sha256']:
+            return url_id
+    # NOTE: A recompressed copy has a different content hash. Look for a deck image with the same aspect ratio and a close perceptual hash,
+    # then confirm it pixel by pixel on the thumbnails because a false match would put the wrong cards into the deck. The largest difference is
+    # used rather than the average, so that errata on a single card isn't mistaken for recompression.
+    url_ids = [url_id for url_id, known in fingerprints.items() if abs(known['size'][0] / known['size'][1] - fingerprint['size'][0] / fingerprint['size'][1]) < 0.01]
+    if not url_ids:
+        return None
+    distances = get_hash_distances([fingerprint['phash']], [fingerprints[url_id]['phash'] for url_id in url_ids])[0]
+    thumbnail = numpy.asarray(get_deck_thumbnail(filename), dtype=numpy.float64)
+    for url_id, distance in sorted(zip(url_ids, distances), key=lambda item: item[1]):
+        if distance > 4:
+            break
+        # NOTE: The cached image of a fingerprinted deck may have been deleted since, it can't be confirmed then.
+        known_filename = get_cached_deck_image_filename(url_id)
+        if not os.path.isfile(known_filename):
+            continue
+        known_thumbnail = numpy.asarray(get_deck_thumbnail(known_filename), dtype=numpy.float64)
+        if numpy.abs(known_thumbnail - thumbnail).max() <= 12:
+            return url_id
+    return None
+
+def resolve_en_url_ids(urls):
+    url_map, url_id_map = read_url_map()
+    new_urls = [url for url in dict.fromkeys(urls) if url not in url_id_map]
+    if not new_urls:
+        return
+
+    # NOTE: Download new urls before assigning url ids, so that a deck image re-hosted under a new url keeps its url id and everything done for it.
+    decks_folder = f'{args.cache_dir}/decks'
+    ensure_dir(decks_folder)
+    new_filenames = {url: f'{decks_folder}/new-{hashlib.sha1(url.encode("utf-8")).hexdigest()}.jpg' for url in new_urls}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.download_workers) as executor:
+        futures = [executor.submit(fetch_deck_image, url, filename) for url, filename in new_filenames.items() if not os.path.isfile(filename)]
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            future.result()
+            print(f'Downloaded new deck image ({i + 1}/{len(futures)})...')
+
+    # NOTE: Fingerprint the known deck images that are still in the cache, once.
+    fingerprints = read_deck_fingerprints()
+    for url_id in url_map.get('en', {}):
+        filename = f'{decks_folder}/{url_id}.jpg'
+        if url_id not in fingerprints and os.path.isfile(filename):
+            fingerprints[url_id] = get_deck_fingerprint(filename)
+
+    for url, new_filename in new_filenames.items():
+        fingerprint = get_deck_fingerprint(new_filename)
+        url_id = find_matching_deck(fingerprint, new_filename)
+        if url_id:
+            print(f'Reusing {url_id} for {url}...')
+            add_en_url_alias(url, url_id)
+        else:
+            url_id = add_en_url(url)
+            fingerprints[url_id] = fingerprint
+        filename = f'{decks_folder}/{url_id}.jpg'
+        if os.path.isfile(filename):
+            os.remove(new_filename)
+        else:
+            os.replace(new_filename, filename)
+    write_deck_fingerprints()
 
-def crop_card_image(result_id, deck_image_filename):
+def download_deck_image(url):
+    return download_deck_images([url])[url]
+
+deck_geometry = None
+def read_deck_geometry():
+    global deck_geometry
+    filename = f'{args.cache_dir}/geometry.json'
+    if deck_geometry is None:
+        deck_geometry = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                deck_geometry = json.loads(file.read())
+    return deck_geometry
+
+def write_deck_geometry():
+    ensure_dir(args.cache_dir)
+    if deck_geometry is not None:
+        with open(f'{args.cache_dir}/geometry.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(deck_geometry, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def has_deck_size(url_id):
+    return url_id in read_deck_geometry()
+
+def ensure_deck_size(url_id, deck_image_filename):
+    geometry = read_deck_geometry()
+    if url_id not in geometry:
+        # NOTE: Opening an image only reads its header, the pixels are not decoded until they're accessed.
+        with Image.open(deck_image_filename) as deck_image:
+            geometry[url_id] = list(deck_image.size)
+    return tuple(geometry[url_id])
+
+def get_deck_size(url_id):
+    if not has_deck_size(url_id):
+        url_map, _ = read_url_map()
+        return ensure_deck_size(url_id, download_deck_image(url_map['en'][url_id]))
+    return tuple(read_deck_geometry()[url_id])
+
+def get_card_box(deck_size, deck_w, deck_h, deck_x, deck_y):
+    width = deck_size[0] / deck_w
+    height = deck_size[1] / deck_h
+    left = deck_x * width
+    top = deck_y * height
+    # NOTE: Round the same way as Pillow does for fractional crop boxes.
+    return round(left), round(top), round(left + width), round(top + height)
+
+# NOTE: Card templates are laid out at 375x525 for a 2.5x3.5 inch card, that's 150 ppi, and make.js renders them at 300 ppi.
+template_width = 375
+template_height = 525
+template_ppi = 150
+render_ppi = 300
+
+def get_card_box_size(result_id):
+    url_id, deck_w, deck_h, deck_x, deck_y, _, _ = decode_result_id(result_id)
+    left, top, right, bottom = get_card_box(get_deck_size(url_id), deck_w, deck_h, deck_x, deck_y)
+    return right - left, bottom - top
+
+def get_card_portrait_box_size(result_id):
+    # NOTE: The portrait size along the sides of the deck slot, its width is laid along the template width whether or not the card is rotated.
+    width, height = get_card_box_size(result_id)
+    if args.prescale_portraits:
+        # NOTE: Any detail beyond the template size at render resolution is thrown away by Strange Eons, so reduce the portrait beforehand.
+        factor = template_width * render_ppi / template_ppi / width
+        if factor < 1:
+            width = max(1, round(width * factor))
+            height = max(1, round(height * factor))
+    return width, height
+
+def get_upright_size(result_id, size):
+    # NOTE: The cropped card image of a rotated card is turned upright, so its width and height are those of the slot swapped.
+    width, height = size
+    return (height, width) if decode_result_id(result_id)[5] else (width, height)
+
+def get_card_image_size(result_id):
+    return get_upright_size(result_id, get_card_box_size(result_id))
+
+def get_card_portrait_size(result_id):
+    return get_upright_size(result_id, get_card_portrait_box_size(result_id))
+
+def get_card_image_scale(result_id):
+    return template_width / get_card_portrait_box_size(result_id)[0]
+
+# NOTE: The cropped card cache format, as the file extension and the Pillow save options. Tiles are raw pixels kept in a memory-mappable container per deck.
+crop_formats = {
+    'png': ('png', {'format': 'PNG'}),
+    'png-fast': ('png', {'format': 'PNG', 'compress_level': 1}),
+    'webp': ('webp', {'format': 'WEBP', 'lossless': True, 'quality': 0, 'method': 0}),
+    'tiles': ('tiles', None),
+}
+
+def get_card_image_filename(result_id, cards_folder=None, crop_format=None):
+    cards_folder = cards_folder or f'{args.cache_dir}/cards'
+    crop_format = crop_format or args.crop_format
+    extension, _ = crop_formats[crop_format]
+    if crop_format == 'tiles':
+        return f'{cards_folder}/{decode_result_id(result_id)[0]}.{extension}'
+    return f'{cards_folder}/{result_id}.{extension}'
+
+tile_indexes = {}
+tile_maps = {}
+def read_tile_index(filename):
+    if filename not in tile_indexes:
+        tile_indexes[filename] = {}
+        if os.path.isfile(f'{filename}.json'):
+            with open(f'{filename}.json', 'r', encoding='utf-8') as file:
+                tile_indexes[filename] = json.loads(file.read())
+    return tile_indexes[filename]
+
+def write_tiles(filename, card_pixels):
+    index = read_tile_index(filename)
+    with open(filename, 'ab') as file:
+        file.seek(0, os.SEEK_END)
+        offset = file.tell()
+        for result_id, (pixels, mode) in card_pixels.items():
+            file.write(pixels.tobytes())
+            index[result_id] = [offset, pixels.shape[0], pixels.shape[1], mode]
+            offset += pixels.nbytes
+    # NOTE: The index is written after the tiles, so that an interrupted run only leaves unreferenced bytes at the end of the container.
+    with open(f'{filename}.json.part', 'w', encoding='utf-8') as file:
+        file.write(json.dumps(index, sort_keys=True))
+    os.replace(f'{filename}.json.part', f'{filename}.json')
+    tile_maps.pop(filename, None)
+
+def read_tile(filename, result_id):
+    offset, height, width, mode = read_tile_index(filename)[result_id]
+    if filename not in tile_maps:
+        tile_maps[filename] = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+    channels = Image.getmodebands(mode)
+    pixels = tile_maps[filename][offset:offset + height * width * channels].reshape((height, width, channels) if channels > 1 else (height, width))
+    return Image.fromarray(pixels, mode)
+
+def has_card_image(result_id, cards_folder=None, crop_format=None):
+    crop_format = crop_format or args.crop_format
+    filename = get_card_image_filename(result_id, cards_folder, crop_format)
+    if crop_format == 'tiles':
+        return result_id in read_tile_index(filename)
+    return os.path.isfile(filename)
+
+def load_card_image(result_id, cards_folder=None, crop_format=None):
+    crop_format = crop_format or args.crop_format
+    filename = get_card_image_filename(result_id, cards_folder, crop_format)
+    if crop_format == 'tiles':
+        return read_tile(filename, result_id)
+    return Image.open(filename)
+
+def get_card_portrait_filename(result_id):
+    filename = get_card_image_filename(result_id)
+    size = get_card_portrait_size(result_id)
+    prescaled = size != get_card_image_size(result_id)
+    if args.crop_format in ['png', 'png-fast'] and not prescaled:
+        return filename
+    # NOTE: Strange Eons can't read the other cache formats, so hand it a fast compressed PNG made from the cached card image instead.
+    # It's written by 'write_card_portraits' and kept between runs, the size in the name tells prescaled portraits of other sizes apart.
+    portraits_folder = f'{args.cache_dir}/portraits'
+    return f'{portraits_folder}/{result_id}-{size[0]}x{size[1]}.png' if prescaled else f'{portraits_folder}/{result_id}.png'
+
+def write_card_portraits(result_ids, card_pixels=None):
+    # NOTE: Only portraits missing from the cache are made, from the given card pixels if they're already decoded.
+    pending = []
+    for result_id in result_ids:
+        filename = get_card_portrait_filename(result_id)
+        if filename != get_card_image_filename(result_id) and not os.path.isfile(filename):
+            pending.append((result_id, filename))
+    if not pending:
+        return
+    ensure_dir(f'{args.cache_dir}/portraits')
+
+    def save(result_id, filename):
+        if card_pixels and result_id in card_pixels:
+            pixels, mode = card_pixels[result_id]
+            image = Image.fromarray(numpy.ascontiguousarray(pixels), mode)
+        else:
+            image = load_card_image(result_id)
+        size = get_card_portrait_size(result_id)
+        if size != image.size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        # NOTE: Save through a temporary file so that an interrupted run never leaves a partial portrait behind.
+        image.save(f'{filename}.part', format='PNG', compress_level=1)
+        os.replace(f'{filename}.part', filename)
+
+    print(f'Writing {len(pending)} portraits...')
+    # NOTE: Resizing and encoding release the GIL, so portraits can be written in parallel threads like cropped card images.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.crop_workers) as executor:
+        list(executor.map(lambda item: save(*item), pending))
+
+def cut_card_images(deck_image, result_ids):
+    # NOTE: Card images are cut as views into the decoded deck pixels, they're only copied when saved.
+    if deck_image.mode not in ['L', 'RGB', 'RGBA']:
+        deck_image = deck_image.convert('RGB' if deck_image.mode in ['CMYK', 'YCbCr'] else 'RGBA')
+    deck_pixels = numpy.asarray(deck_image)
+    card_pixels = {}
+    for result_id in result_ids:
+        _, deck_w, deck_h, deck_x, deck_y, rotate, _ = decode_result_id(result_id)
+        left, top, right, bottom = get_card_box(deck_image.size, deck_w, deck_h, deck_x, deck_y)
+        pixels = deck_pixels[top:bottom, left:right]
+        if rotate:
+            pixels = numpy.rot90(pixels)
+        card_pixels[result_id] = (pixels, deck_image.mode)
+    return card_pixels
+
+def save_card_images(card_pixels, cards_folder, crop_format):
+    if crop_format == 'tiles':
+        deck_card_pixels = {}
+        for result_id, (pixels, mode) in card_pixels.items():
+            filename = get_card_image_filename(result_id, cards_folder, crop_format)
+            deck_card_pixels.setdefault(filename, {})[result_id] = (numpy.ascontiguousarray(pixels), mode)
+        for filename, pixels in deck_card_pixels.items():
+            write_tiles(filename, pixels)
+        return
+
+    _, options = crop_formats[crop_format]
+    def save(result_id):
+        pixels, mode = card_pixels[result_id]
+        card_image = Image.fromarray(numpy.ascontiguousarray(pixels), mode)
+        # NOTE: Save through a temporary file so that an interrupted run never leaves a partial card image behind.
+        filename = get_card_image_filename(result_id, cards_folder, crop_format)
+        card_image.save(f'{filename}.part', **options)
+        os.replace(f'{filename}.part', filename)
+
+    # NOTE: Image encoding releases the GIL, so cards can be saved in parallel threads.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.crop_workers) as executor:
+        list(executor.map(save, card_pixels))
+
+def crop_card_images(deck_image_filename, result_ids):
     cards_folder = f'{args.cache_dir}/cards'
     ensure_dir(cards_folder)
-    filename = f'{cards_folder}/{result_id}.png'
-    if not os.path.isfile(filename):
-        print(f'Cropping {result_id}.png...')
-        _, deck_w, deck_h, deck_x, deck_y, rotate, _ = decode_result_id(result_id)
+    pending = [result_id for result_id in result_ids if not has_card_image(result_id)]
+    if not pending:
+        return
+
+    print(f'Cropping {len(pending)} cards from {os.path.basename(deck_image_filename)}...')
+    # NOTE: Decode the deck image only once for all of its cards.
+    with Image.open(deck_image_filename) as deck_image:
+        deck_image.load()
+        ensure_deck_size(decode_result_id(pending[0])[0], deck_image_filename)
+        card_pixels = cut_card_images(deck_image, pending)
+        save_card_images(card_pixels, cards_folder, args.crop_format)
+        # NOTE: Reduce the portraits while the card pixels are still decoded, rather than decoding the cached card images again to generate.
+        if args.prescale_portraits:
+            write_card_portraits(pending, card_pixels)
+
+def benchmark_crop_formats():
+    # NOTE: Benchmark with the cards of previous runs, or a 10x7 grid over each deck image if there are none.
+    deck_result_ids = {}
+    for result_ids in read_result_map().values():
+        for result_id in result_ids:
+            deck_result_ids.setdefault(decode_result_id(result_id)[0], set()).add(result_id)
+    deck_image_filenames = sorted(glob.glob(f'{args.cache_dir}/decks/*.jpg'))[:args.benchmark_samples]
+    if not deck_image_filenames:
+        print(f'No deck images in {args.cache_dir}/decks to benchmark with')
+        return
+
+    card_pixels = {}
+    deck_images = []
+    for deck_image_filename in deck_image_filenames:
+        url_id = os.path.basename(deck_image_filename).split('.')[0]
+        result_ids = deck_result_ids.get(url_id) or [encode_result_id(url_id, 10, 7, x, y, False, 0) for x in range(10) for y in range(7)]
         deck_image = Image.open(deck_image_filename)
-        width = deck_image.width / deck_w
-        height = deck_image.height / deck_h
-        left = deck_x * width
-        top = deck_y * height
-        card_image = deck_image.crop((left, top, left + width, top + height))
-        if rotate:
-            card_image = card_image.transpose(method=Image.Transpose.ROTATE_90)
-        card_image.save(filename)
-    return filename
+        deck_image.load()
+        deck_images.append(deck_image)
+        card_pixels.update(cut_card_images(deck_image, sorted(result_ids)))
+
+    print(f'Benchmarking {len(card_pixels)} cards from {len(deck_image_filenames)} decks...')
+    print(f'{"format":<10}{"encode (s)":>12}{"decode (s)":>12}{"size (MB)":>12}')
+    for crop_format in crop_formats:
+        cards_folder = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            save_card_images(card_pixels, cards_folder, crop_format)
+            encode_time = time.perf_counter() - start
+            tile_indexes.clear()
+            tile_maps.clear()
+            start = time.perf_counter()
+            for result_id in card_pixels:
+                load_card_image(result_id, cards_folder, crop_format).load()
+            decode_time = time.perf_counter() - start
+            size = sum(os.path.getsize(filename) for filename in glob.glob(f'{cards_folder}/*'))
+            print(f'{crop_format:<10}{encode_time:>12.2f}{decode_time:>12.2f}{size / 1024 / 1024:>12.1f}')
+        finally:
+            tile_maps.clear()
+            shutil.rmtree(cards_folder, ignore_errors=True)
+
+# NOTE: The card image file extension of each --se-image-format as written by make.js, and the Pillow save options closest to it.
+se_image_formats = {
+    'png': ('.png', {'format': 'PNG'}),
+    'png-fast': ('.png', {'format': 'PNG', 'compress_level': 1}),
+    'tiff': ('.tif', {'format': 'TIFF'}),
+}
+
+def benchmark_handoff_formats():
+    # NOTE: Benchmark with the most recently generated card images, encoded with Pillow the way make.js writes each --se-image-format.
+    image_files = sorted(get_generated_image_files().items())[:args.benchmark_samples * 10]
+    if not image_files:
+        print('No generated card images in SE_Generator/images to benchmark with')
+        return
+
+    images = {}
+    slot_images = {}
+    for result_id, image_filename in image_files:
+        image = Image.open(image_filename)
+        image.load()
+        images[result_id] = image
+        width, height = get_card_slot_size(result_id)
+        slot_images[result_id] = image.resize((height, width) if decode_result_id(result_id)[5] else (width, height))
+
+    print(f'Benchmarking {len(images)} card images...')
+    print(f'{"format":<10}{"size":>6}{"write (s)":>12}{"read (s)":>12}{"size (MB)":>12}')
+    for handoff_format, (extension, options) in se_image_formats.items():
+        for size, size_images in [('full', images), ('slot', slot_images)]:
+            images_folder = tempfile.mkdtemp()
+            try:
+                start = time.perf_counter()
+                for result_id, image in size_images.items():
+                    image.save(f'{images_folder}/{result_id}{extension}', **options)
+                write_time = time.perf_counter() - start
+                # NOTE: Read the images the way the pack step does.
+                start = time.perf_counter()
+                for result_id in size_images:
+                    card_image = Image.open(f'{images_folder}/{result_id}{extension}')
+                    if decode_result_id(result_id)[5]:
+                        card_image = card_image.transpose(method=Image.Transpose.ROTATE_270)
+                    card_image.resize(get_card_slot_size(result_id))
+                read_time = time.perf_counter() - start
+                disk_size = sum(os.path.getsize(filename) for filename in glob.glob(f'{images_folder}/*'))
+                print(f'{handoff_format:<10}{size:>6}{write_time:>12.2f}{read_time:>12.2f}{disk_size / 1024 / 1024:>12.1f}')
+            finally:
+                shutil.rmtree(images_folder, ignore_errors=True)
+
+    # NOTE: The write times above are Pillow's, the time make.js actually spends writing is recorded in its timings.
+    if os.path.isfile('SE_Generator/timings.json'):
+        with open('SE_Generator/timings.json', 'r', encoding='utf-8') as file:
+            for se_type, timing in json.loads(file.read()).items():
+                if timing['count'] and 'write' in timing:
+                    print(f'make.js wrote {timing["count"]} {se_type} cards at {timing["write"] * 1000 / timing["count"]:.0f}ms per card')
 
 se_types = [
     'asset',
@@ -1842,6 +2722,8 @@ se_types = [
 ]
 se_cards = dict(zip(se_types, [[] for _ in range(len(se_types))]))
 result_set = set()
+pending_cards = []
+skipped_card_keys = []
 
 def get_decks(object):
     decks = []
@@ -1853,10 +2735,16 @@ def translate_sced_card(url, deck_w, deck_h, deck_x, deck_y, is_front, card, met
     card_type = card['type_code']
     rotate = card_type in ['investigator', 'agenda', 'act']
     sheet = 0 if is_front else 1
-    result_id = encode_result_id(get_en_url_id(url), deck_w, deck_h, deck_x, deck_y, rotate, sheet)
-    if result_id in result_set:
+    # NOTE: The url ids of new urls are only resolved once their deck images are downloaded together, so identify the card by its url until then.
+    card_key = (url, deck_w, deck_h, deck_x, deck_y, rotate, sheet)
+    if card_key in result_set:
+        return
+    # NOTE: Keep the original face in the deck image when ArkhamDB has no translation for its text, rendering it again only loses quality.
+    if not is_face_translated(card, is_front):
+        print(f'Skipping untranslated {card["code"]} {"front" if is_front else "back"}...')
+        skipped_card_keys.append(card_key)
+        result_set.add(card_key)
         return
-    print(f'Translating {result_id}...')
 
     if card_type == 'asset':
         if get_field(card, 'encounter_code', None):
@@ -1933,12 +2821,6 @@ def translate_sced_card(url, deck_w, deck_h, deck_x, deck_y, is_front, card, met
     else:
         se_type = None
 
-    deck_image_filename = download_deck_image(url)
-    image_filename = crop_card_image(result_id, deck_image_filename)
-    image = Image.open(image_filename)
-    template_width = 375
-    template_height = 525
-    image_scale = template_width / (image.height if rotate else image.width)
     move_map = {
         'asset': (0, 93),
         'asset_encounter': (0, 93),
@@ -1974,9 +2856,215 @@ def translate_sced_card(url, deck_w, deck_h, deck_x, deck_y, is_front, card, met
     else:
         move_map_se_type = se_type
     image_move_x, image_move_y = move_map[move_map_se_type]
-    image_filename = os.path.abspath(image_filename)
-    se_cards[se_type].append(get_se_card(result_id, card, metadata, image_filename, image_scale, image_move_x, image_move_y))
-    result_set.add(result_id)
+    # NOTE: The card image is only needed after all deck images are downloaded together, so defer the rest of the translation until then.
+    pending_cards.append((card_key, se_type, card, metadata, image_move_x, image_move_y))
+    result_set.add(card_key)
+
+# NOTE: Cards whose perceptual hash is within this many bits of a generic card back, and whose aspect ratio and mean colour are close to
+# it, are considered generic card backs. Dark or plain card backs can be near in hash alone.
+generic_back_distance = 6
+generic_back_aspect_tolerance = 0.02
+generic_back_colour_tolerance = 12
+generic_back_references = {}
+
+def add_generic_back_reference(url, deck_w, deck_h, deck_x, deck_y):
+    generic_back_references[(url, deck_w, deck_h, deck_x, deck_y, False, 1)] = url
+
+card_hashes = None
+def read_card_hashes():
+    global card_hashes
+    filename = f'{args.cache_dir}/fingerprints.json'
+    if card_hashes is None:
+        card_hashes = {'references': {}, 'cards': {}}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                card_hashes = json.loads(file.read())
+    return card_hashes
+
+def write_card_hashes():
+    ensure_dir(args.cache_dir)
+    if card_hashes is not None:
+        with open(f'{args.cache_dir}/fingerprints.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(card_hashes, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def get_perceptual_hashes(images):
+    # NOTE: DCT based perceptual hash. All images are transformed at once as a stack of 32x32 grayscale thumbnails, and the lowest 8x8 frequencies
+    # are compared against their median.
+    size = 32
+    pixels = numpy.stack([numpy.asarray(image.convert('L').resize((size, size), Image.Resampling.LANCZOS), dtype=numpy.float64) for image in images])
+    n = numpy.arange(size)
+    dct = numpy.cos(numpy.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    frequencies = (dct @ pixels @ dct.T)[:, :8, :8].reshape(len(images), 64)
+    bits = frequencies > numpy.median(frequencies[:, 1:], axis=1, keepdims=True)
+    return [numpy.packbits(row).tobytes().hex() for row in bits]
+
+def get_hash_distances(hashes, reference_hashes):
+    a = numpy.array([int(value, 16) for value in hashes], dtype=numpy.uint64)
+    b = numpy.array([int(value, 16) for value in reference_hashes], dtype=numpy.uint64)
+    x = (a[:, None] ^ b[None, :]).view(numpy.uint8).reshape(len(a), len(b), 8)
+    return numpy.unpackbits(x, axis=-1).sum(axis=-1)
+
+# NOTE: Copies of a face cropped from different deck images are never bit identical, JPEG blocks and neighbouring slots differ. A copy is
+# confirmed on small grayscale thumbnails instead, which average out the encoding noise but still tell apart different artworks or errata.
+face_hash_distance = 4
+face_thumbnail_size = 32
+face_thumbnail_difference = 8
+
+face_thumbnails = {}
+def get_face_thumbnail(result_id):
+    if result_id not in face_thumbnails:
+        with load_card_image(result_id) as image:
+            thumbnail = image.convert('L').resize((face_thumbnail_size, face_thumbnail_size), Image.Resampling.BOX)
+        face_thumbnails[result_id] = numpy.asarray(thumbnail, dtype=numpy.float64)
+    return face_thumbnails[result_id]
+
+def is_same_face(result_id, candidate_id, face_hashes):
+    if get_hash_distances([face_hashes[result_id]], [face_hashes[candidate_id]])[0][0] > face_hash_distance:
+        return False
+    return numpy.abs(get_face_thumbnail(result_id) - get_face_thumbnail(candidate_id)).max() <= face_thumbnail_difference
+
+def get_card_hashes(result_ids, hashes):
+    # NOTE: Hashes are cached per url id, so they're only computed once for each card image.
+    missing = [result_id for result_id in result_ids if result_id not in hashes.get(decode_result_id(result_id)[0], {})]
+    for i in range(0, len(missing), 256):
+        batch = missing[i:i + 256]
+        for result_id, value in zip(batch, get_perceptual_hashes([load_card_image(result_id) for result_id in batch])):
+            hashes.setdefault(decode_result_id(result_id)[0], {})[result_id] = value
+    return [hashes[decode_result_id(result_id)[0]][result_id] for result_id in result_ids]
+
+def find_generic_backs(result_ids, reference_ids):
+    hashes = read_card_hashes()
+    references = hashes['references']
+    for result_id, value in zip(reference_ids, get_card_hashes(reference_ids, hashes['cards'])):
+        references[result_id] = value
+    if not result_ids or not references:
+        write_card_hashes()
+        return set()
+    reference_ids = list(references)
+    distances = get_hash_distances(get_card_hashes(result_ids, hashes['cards']), list(references.values()))
+    write_card_hashes()
+    generic_backs = set()
+    for result_id, distance, nearest in zip(result_ids, distances.min(axis=1), distances.argmin(axis=1)):
+        if distance <= generic_back_distance and is_card_image_similar(result_id, reference_ids[nearest]):
+            generic_backs.add(result_id)
+    return generic_backs
+
+def is_card_image_similar(result_id, reference_id):
+    if not has_card_image(reference_id):
+        return False
+    with load_card_image(result_id) as image, load_card_image(reference_id) as reference:
+        if abs(image.width / image.height - reference.width / reference.height) > generic_back_aspect_tolerance:
+            return False
+        colour = numpy.asarray(image.convert('RGB'), dtype=numpy.float64).mean(axis=(0, 1))
+        reference_colour = numpy.asarray(reference.convert('RGB'), dtype=numpy.float64).mean(axis=(0, 1))
+    return numpy.abs(colour - reference_colour).max() <= generic_back_colour_tolerance
+
+face_aliases = None
+def read_face_aliases():
+    global face_aliases
+    filename = f'{args.cache_dir}/faces/{args.lang}.json'
+    if face_aliases is None:
+        face_aliases = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                face_aliases = json.loads(file.read())
+    return face_aliases
+
+def write_face_aliases():
+    ensure_dir(f'{args.cache_dir}/faces')
+    if face_aliases is not None:
+        with open(f'{args.cache_dir}/faces/{args.lang}.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(face_aliases, indent=2, sort_keys=True)
+            file.write(json_str)
+
+def get_face_key(se_type, result_id, component):
+    # NOTE: Leave out the fields that only differ by where the face is cropped from.
+    row = {key: value for key, value in component.items() if key not in ['file', 'port0Src', 'port0Scale', 'port1Src', 'port1Scale']}
+    return se_type, decode_result_id(result_id)[-1], get_row_hash(row)
+
+def set_face_alias(result_id, representative):
+    aliases = read_face_aliases()
+    # NOTE: A face that used to be a copy of another face has never been generated, make sure it's generated in incremental mode.
+    if representative == result_id and result_id in aliases:
+        read_rule_manifest()['dirty'].add(result_id)
+    if representative == result_id:
+        aliases.pop(result_id, None)
+    else:
+        aliases[result_id] = representative
+
+def get_card_result_id(card_key):
+    url, deck_w, deck_h, deck_x, deck_y, rotate, sheet = card_key
+    return encode_result_id(get_en_url_id(url), deck_w, deck_h, deck_x, deck_y, rotate, sheet)
+
+def translate_pending_cards():
+    global rule_trace
+    resolve_en_url_ids([card_key[0] for card_key, *_ in pending_cards] + list(generic_back_references.values()))
+    reference_ids = {get_card_result_id(card_key): url for card_key, url in generic_back_references.items()}
+    # NOTE: A face of a deck image never seen before can't have been generated before, so only faces of known deck images are recorded.
+    _, url_id_map = read_url_map()
+    for card_key in skipped_card_keys:
+        if card_key[0] in url_id_map:
+            record_skipped_result(get_card_result_id(card_key))
+    cards = []
+    result_ids = set()
+    for card_key, se_type, card, metadata, image_move_x, image_move_y in pending_cards:
+        result_id = get_card_result_id(card_key)
+        # NOTE: Different urls of the same deck image resolve to the same url id, only translate them once.
+        if result_id in result_ids:
+            continue
+        result_ids.add(result_id)
+        print(f'Translating {result_id}...')
+        cards.append((result_id, card_key[0], se_type, card, metadata, image_move_x, image_move_y))
+
+    deck_urls = {}
+    deck_result_ids = {}
+    for result_id, url in [(result_id, url) for result_id, url, *_ in cards] + list(reference_ids.items()):
+        url_id = decode_result_id(result_id)[0]
+        deck_urls.setdefault(url_id, url)
+        deck_result_ids.setdefault(url_id, []).append(result_id)
+    # NOTE: Only touch deck images with missing card images or unknown geometry, so that a warm cache run doesn't read any image files.
+    crop_url_ids = []
+    for url_id, result_ids in deck_result_ids.items():
+        if not has_deck_size(url_id) or not all(has_card_image(result_id) for result_id in result_ids):
+            crop_url_ids.append(url_id)
+    deck_image_filenames = download_deck_images([deck_urls[url_id] for url_id in crop_url_ids])
+    for url_id in crop_url_ids:
+        crop_card_images(deck_image_filenames[deck_urls[url_id]], deck_result_ids[url_id])
+    write_deck_geometry()
+
+    # NOTE: Skip cards that look like generic player or encounter card backs but were not caught by the rules while visiting the objects.
+    result_ids = [result_id for result_id, *_ in cards]
+    generic_backs = find_generic_backs(result_ids, list(reference_ids))
+    face_hashes = dict(zip(result_ids, get_card_hashes(result_ids, read_card_hashes()['cards'])))
+    face_representatives = {}
+
+    for result_id, url, se_type, card, metadata, image_move_x, image_move_y in cards:
+        if result_id in generic_backs:
+            print(f'Skipping generic card back {result_id}...')
+            continue
+        image_filename = os.path.abspath(get_card_portrait_filename(result_id))
+        image_scale = get_card_image_scale(result_id)
+        # NOTE: Turn tracing off even if building the row fails, so that later callers don't trace into a stale set.
+        rules = rule_trace = set()
+        try:
+            component = get_se_card(result_id, card, metadata, image_filename, image_scale, image_move_x, image_move_y)
+        finally:
+            rule_trace = None
+        record_rule_row(result_id, component, rules)
+        add_result_id(card['code'], result_id)
+        # NOTE: The same face with the same translation is only generated once, its image is used for every copy while packing. A close
+        # perceptual hash only narrows down the candidates, different artworks can collide, so a copy is confirmed on its thumbnail.
+        candidates = face_representatives.setdefault(get_face_key(se_type, result_id, component), [])
+        representative = next((candidate for candidate in candidates if is_same_face(result_id, candidate, face_hashes)), None)
+        if representative is None:
+            candidates.append(result_id)
+            representative = result_id
+        set_face_alias(result_id, representative)
+        if representative == result_id:
+            se_cards[se_type].append(component)
+    write_card_hashes()
+    pending_cards.clear()
 
 def translate_sced_card_object(object, metadata, card):
     deck_id, deck = get_decks(object)[0]
@@ -2074,6 +3162,11 @@ def translate_sced_card_object(object, metadata, card):
     # NOTE: Test whether it's generic player or encounter card back urls.
     if 'EcbhVuh' in back_url or 'sRsWiSG' in back_url:
         translate_back = False
+        # NOTE: Also use known generic card backs as references to detect the ones not caught by these rules.
+        if deck['UniqueBack']:
+            add_generic_back_reference(back_url, deck_w, deck_h, deck_x, deck_y)
+        else:
+            add_generic_back_reference(back_url, 1, 1, 0, 0)
     # NOTE: Special cases to skip generic player or encounter card back in deck images.
     if (deck_id, deck_x, deck_y) in [
             (2335, 9, 5),
@@ -2113,6 +3206,10 @@ def translate_sced_card_object(object, metadata, card):
             (5469, 7, 1)
     ]:
         translate_back = False
+        if deck['UniqueBack']:
+            add_generic_back_reference(back_url, deck_w, deck_h, deck_x, deck_y)
+        else:
+            add_generic_back_reference(back_url, 1, 1, 0, 0)
 
     if translate_back:
         # NOTE: If back side has a separate entry, then it's treated as if it's the front side of the card.
@@ -2148,7 +3245,7 @@ def process_player_cards(callback):
                 ahdb_id = metadata['id']
                 if is_translatable(ahdb_id):
                     card = download_card(ahdb_id)
-                    if eval(args.filter):
+                    if eval(args.filter) and is_selected(card):
                         object_filename = metadata_filename.replace('.gmnotes', '.json')
                         with open(object_filename, 'r', encoding='utf-8') as object_file:
                             object = json.loads(object_file.read())
@@ -2208,7 +3305,7 @@ def process_encounter_cards(callback, **kwargs):
                         ahdb_id = metadata['id']
                         if is_translatable(ahdb_id):
                             card = download_card(ahdb_id)
-                            if eval(args.filter):
+                            if eval(args.filter) and is_selected(card):
                                 callback(object, metadata, card, campaign_filename, campaign)
 
 def write_csv():
@@ -2219,6 +3316,9 @@ def write_csv():
         filename = f'{data_dir}/{se_type}.csv'
         with open(filename, mode='w', newline='', encoding='utf-8') as file:
             components = se_cards[se_type]
+            # NOTE: In incremental mode, only rows affected by changes since the last upload are generated again.
+            if args.incremental:
+                components = [component for component in components if is_dirty_result(component['file'])]
             if len(components):
                 fields = list(components[0].keys())
                 writer = csv.DictWriter(file, fieldnames=fields)
@@ -2226,10 +3326,16 @@ def write_csv():
                 for component in components:
                     writer.writerow(component)
 
-def generate_images():
-    # NOTE: Update SE font preferences before running the generation script.
+def get_lang_preferences():
     lang_code, _ = get_lang_code_region()
-    lang_preferences = f'translations/{lang_code}/preferences'
+    return f'translations/{lang_code}/preferences'
+
+def apply_se_preferences():
+    # NOTE: Update SE font preferences before running the generation script.
+    lang_preferences = get_lang_preferences()
+    if not os.path.isfile(args.se_preferences):
+        print(f'Skipping missing Strange Eons preferences {args.se_preferences}...')
+        return
     print(f'Overwriting with {lang_preferences}...')
     overwrites = {}
     with open(lang_preferences, mode='r', encoding='utf-8') as file:
@@ -2251,41 +3357,872 @@ def generate_images():
             else:
                 file.write(line)
 
+def generate_images():
+    # NOTE: Returns whether the deck images were packed while rendering.
+    # NOTE: Only Strange Eons rendering on this machine reads its preferences, shard bundles carry the language preferences themselves.
+    if args.renderer == 'strange-eons' and not args.export_shards and not args.import_shards:
+        apply_se_preferences()
+    lang_preferences = get_lang_preferences()
+    # NOTE: Keep a copy of the language preferences in the project, make.js renders the cards again when they change.
+    shutil.copyfile(lang_preferences, 'SE_Generator/preferences')
+    with open('SE_Generator/options.json', 'w', encoding='utf-8') as file:
+        options = {'cardFiles': args.se_card_files, 'imageFormat': args.se_image_format}
+        if args.se_render_slot_size:
+            options['ppi'] = {result_id: get_card_slot_ppi(result_id) for result_id in get_csv_result_ids()}
+        json_str = json.dumps(options, indent=2)
+        file.write(json_str)
+
+    shards_folder = f'{args.shards_dir}/{args.lang}'
+    if args.import_shards:
+        import_shard_bundles(sorted(os.path.dirname(filename) for filename in glob.glob(f'{shards_folder}/*/manifest.json')))
+        return False
+    # NOTE: Portraits cached before are reused, so this only costs anything for new cards or after the crop format changed.
+    write_card_portraits(get_csv_result_ids())
+    if args.export_shards:
+        export_shard_bundles(shards_folder, args.export_shards, True)
+        return False
+    return render_images()
+
+se_service_folder = 'SE_Generator/queue'
+se_service_timeout = 30
+
+def run_se_service():
+    # NOTE: The service is a headless Strange Eons process which keeps running serve.js, so that the JVM, the plugins and the templates are
+    # loaded once for all render jobs. Strange Eons reads its preferences at startup, so the service only takes jobs for its language.
+    apply_se_preferences()
+    ensure_dir(se_service_folder)
+    for filename in ['stop', 'heartbeat']:
+        if os.path.isfile(f'{se_service_folder}/{filename}'):
+            os.remove(f'{se_service_folder}/{filename}')
+    with open(f'{se_service_folder}/service.json', 'w', encoding='utf-8') as file:
+        service = {'lang': args.lang, 'preferences': get_file_hash(args.se_preferences) if os.path.isfile(args.se_preferences) else None}
+        json_str = json.dumps(service, indent=2)
+        file.write(json_str)
+
+    se_executable = os.path.abspath(args.se_executable) if os.path.isfile(args.se_executable) else args.se_executable
+    print(f'Serving render jobs from {se_service_folder}...')
+    try:
+        subprocess.run([se_executable, '--glang', args.lang, '--run', 'SE_Generator/serve.js'])
+    except KeyboardInterrupt:
+        print('Stopping render service...')
+        with open(f'{se_service_folder}/stop', 'w', encoding='utf-8'):
+            pass
+
+def is_se_service_alive():
+    heartbeat_filename = f'{se_service_folder}/heartbeat'
+    return os.path.isfile(heartbeat_filename) and time.time() - os.path.getmtime(heartbeat_filename) < se_service_timeout
+
+def is_se_service_running():
+    service_filename = f'{se_service_folder}/service.json'
+    if args.renderer != 'strange-eons' or not os.path.isfile(service_filename) or not is_se_service_alive() or not os.path.isfile(args.se_preferences):
+        return False
+    with open(service_filename, 'r', encoding='utf-8') as file:
+        service = json.loads(file.read())
+    # NOTE: A service started for another language or with other preferences would render with the wrong fonts.
+    if service['lang'] != args.lang or service['preferences'] != get_file_hash(args.se_preferences):
+        print(f'Ignoring render service for {service["lang"]} with different preferences...')
+        return False
+    return True
+
+def claim_se_service_job(project_root):
+    # NOTE: Whoever renames the queued marker first renders the job, so that the service and the generate step never both render it.
+    try:
+        os.rename(f'{project_root}/queued', f'{project_root}/claimed')
+        return True
+    except OSError:
+        return False
+
+def render_with_se_service(project_root):
+    print(f'Queueing {project_root}...')
+    with open(f'{project_root}/queued', 'w', encoding='utf-8'):
+        pass
+    while not os.path.isfile(f'{project_root}/done'):
+        # NOTE: The service touches its heartbeat while rendering each card, so a stale heartbeat means it stopped. Render the job directly
+        # if the service hasn't taken it yet, a job stuck in the service is not rendered a second time.
+        if not is_se_service_alive():
+            if not claim_se_service_job(project_root):
+                raise RuntimeError(f'Render service stopped while rendering {project_root}')
+            print(f'Render service stopped, rendering {project_root} directly...')
+            render_with_strange_eons(project_root)
+            return
+        time.sleep(0.5)
+    if os.path.isfile(f'{project_root}/error'):
+        with open(f'{project_root}/error', 'r', encoding='utf-8') as file:
+            print(f'Render service failed on {project_root}: {file.read().strip()}')
+
+def render_with_strange_eons(project_root):
+    se_executable = os.path.abspath(args.se_executable) if os.path.isfile(args.se_executable) else args.se_executable
     se_script = 'SE_Generator/make.js'
-    print(f'Running {se_script}...')
-    subprocess.run([args.se_executable, '--glang', args.lang, '--run', se_script])
+    print(f'Running {project_root}/{se_script}...')
+    subprocess.run([se_executable, '--glang', args.lang, '--run', se_script], cwd=project_root)
 
-def pack_images():
-    deck_images = {}
-    url_map, _ = read_url_map()
+def get_pillow_font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+def draw_pillow_text_box(draw, box, texts, font_size):
+    left, top, right, bottom = box
+    draw.rectangle(box, fill=(255, 255, 255), outline=(0, 0, 0))
+    font = get_pillow_font(font_size)
+    lines = []
+    for text in texts:
+        # NOTE: Drop the Strange Eons markup tags, the text is only there to cost about as much to draw as the real card text.
+        text = re.sub(r'<[^>]*>', '', text)
+        for paragraph in text.split('\n'):
+            lines.extend(textwrap.wrap(paragraph, width=max(1, int((right - left) / (font_size * 0.55)))) or [''])
+    draw.multiline_text((left + font_size // 2, top + font_size // 2), '\n'.join(lines), fill=(0, 0, 0), font=font)
+
+def render_with_pillow(project_root):
+    # NOTE: A stand-in for Strange Eons to exercise the rest of the pipeline without it. Each card is drawn as its portrait with its text in
+    # plain boxes, at the size and with the filename make.js would use. Unlike make.js, every card is drawn again each time.
+    project_folder = f'{project_root}/SE_Generator'
+    print(f'Rendering {project_folder} with Pillow...')
+    options = {}
+    if os.path.isfile(f'{project_folder}/options.json'):
+        with open(f'{project_folder}/options.json', 'r', encoding='utf-8') as file:
+            options = json.loads(file.read())
+    extension, save_options = se_image_formats[options.get('imageFormat', 'png')]
+    image_folder = f'{project_folder}/images'
+    if os.path.isdir(image_folder):
+        os.rename(image_folder, f'{image_folder}-{uuid.uuid4()}')
+    ensure_dir(image_folder)
+
+    timings = {}
+    report = {'types': {}, 'cards': [], 'memory': []}
+    for filename in sorted(glob.glob(f'{project_folder}/data/*.csv')):
+        se_type = os.path.basename(filename).replace('.csv', '')
+        timing = {'count': 0, 'seconds': 0, 'load': 0, 'paint': 0, 'write': 0}
+        with open(filename, mode='r', newline='', encoding='utf-8') as file:
+            rows = list(csv.DictReader(file))
+        for row in rows:
+            start = time.perf_counter()
+            result_id = row['file']
+            sheet = decode_result_id(result_id)[-1]
+            ppi = options.get('ppi', {}).get(result_id, render_ppi)
+            factor = ppi / template_ppi
+            # NOTE: Cards rotated in the deck image are landscape in Strange Eons.
+            size = (template_height, template_width) if decode_result_id(result_id)[5] else (template_width, template_height)
+            width, height = round(size[0] * factor), round(size[1] * factor)
+            image = Image.new('RGB', (width, height), (96, 96, 96))
+            portrait_filename = row.get(f'port{sheet}Src', '')
+            portrait_filename = options.get('portraits', {}).get(portrait_filename, portrait_filename)
+            if portrait_filename and not os.path.isabs(portrait_filename):
+                portrait_filename = f'{project_root}/{portrait_filename}'
+            portrait = None
+            if portrait_filename and os.path.isfile(portrait_filename):
+                portrait = Image.open(portrait_filename)
+                portrait.load()
+            loaded = time.perf_counter()
+
+            draw = ImageDraw.Draw(image)
+            if portrait:
+                scale = float(row.get(f'port{sheet}Scale') or 1) * factor
+                portrait = portrait.resize((max(1, round(portrait.width * scale)), max(1, round(portrait.height * scale))))
+                x = (width - portrait.width) // 2 + round(float(row.get(f'port{sheet}X') or 0) * factor)
+                y = (height - portrait.height) // 2 + round(float(row.get(f'port{sheet}Y') or 0) * factor)
+                image.paste(portrait, (x, y))
+            if sheet == 0:
+                titles = [row.get('name', ''), row.get('$Subtitle', '')]
+                texts = [row.get('$Traits', ''), row.get('$Rules', ''), row.get('$Flavor', ''), row.get('$Victory', '')]
+            else:
+                titles = [row.get('$TitleBack', '')]
+                texts = [row.get('$FlavorBack', ''), row.get('$InvStoryBack', '')]
+                for i in range(1, 9):
+                    texts.extend([row.get(f'$Text{i}NameBack', ''), row.get(f'$Text{i}Back', '')])
+            font_size = round(10 * factor)
+            draw_pillow_text_box(draw, (width // 10, height // 20, width * 9 // 10, height // 20 + font_size * 4), [text for text in titles if text], font_size)
+            draw_pillow_text_box(draw, (width // 10, height // 2, width * 9 // 10, height * 19 // 20), [text for text in texts if text], font_size)
+            painted = time.perf_counter()
+
+            image.save(f'{image_folder}/{result_id}{extension}', **save_options)
+            written = time.perf_counter()
+            timing['count'] += 1
+            timing['load'] += loaded - start
+            timing['paint'] += painted - loaded
+            timing['write'] += written - painted
+            timing['seconds'] += written - start
+            report['cards'].append({'name': result_id, 'type': se_type, 'load': loaded - start, 'sheet': 0, 'paint': painted - loaded, 'write': written - painted})
+        timings[se_type] = timing
+        report['types'][se_type] = {**timing, 'template': 0, 'sheet': 0}
+        if timing['count']:
+            print(f'Rendered {timing["count"]} {se_type} cards in {timing["seconds"]:.1f}s...')
+    with open(f'{project_folder}/timings.json', 'w', encoding='utf-8') as file:
+        file.write(json.dumps(timings))
+    with open(f'{project_folder}/report.json', 'w', encoding='utf-8') as file:
+        file.write(json.dumps(report))
+    # NOTE: make.js reuses the newest image of a row whose render manifest hash is unchanged, forget the rows drawn here so that the next
+    # Strange Eons run paints them again rather than reusing the stand-in images.
+    render_manifest = read_render_manifest(project_folder)
+    for result_id in [card['name'] for card in report['cards']]:
+        render_manifest.pop(result_id, None)
+    with open(f'{project_folder}/render.json', 'w', encoding='utf-8') as file:
+        file.write(json.dumps(render_manifest))
+
+# NOTE: Each renderer renders the SE_Generator project under the given directory into a new images directory, the way make.js does.
+renderers = {
+    'strange-eons': render_with_strange_eons,
+    'pillow': render_with_pillow,
+}
+
+def get_csv_result_ids():
+    result_ids = []
+    for filename in sorted(glob.glob('SE_Generator/data/*.csv')):
+        with open(filename, mode='r', newline='', encoding='utf-8') as file:
+            result_ids.extend(row['file'] for row in csv.DictReader(file))
+    return result_ids
+
+def get_card_slot_size(result_id):
+    deck_url_id, deck_w, deck_h, _, _, _, _ = decode_result_id(result_id)
+    deck_width, deck_height = get_deck_size(deck_url_id)
+    return deck_width // deck_w, deck_height // deck_h
+
+def get_card_slot_ppi(result_id):
+    # NOTE: A card is 375x525 at template resolution along the sides of its slot, rotated cards are painted sideways and turned back while
+    # packing. Paint it just large enough to cover its slot on both axes, as the slot aspect ratio may differ from the template.
+    slot_width, slot_height = get_card_slot_size(result_id)
+    return math.ceil(template_ppi * max(slot_width / template_width, slot_height / template_height) * 100) / 100
+
+def read_render_costs():
+    filename = f'{args.cache_dir}/render_costs.json'
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, 'r', encoding='utf-8') as file:
+        return json.loads(file.read())
+
+def write_render_costs(timing_filenames):
+    # NOTE: Keep the average render seconds per card of each SE type measured by make.js, to balance the work among workers next time.
+    costs = read_render_costs()
+    timings = {}
+    for filename in timing_filenames:
+        if not os.path.isfile(filename):
+            continue
+        with open(filename, 'r', encoding='utf-8') as file:
+            for se_type, timing in json.loads(file.read()).items():
+                count, seconds = timings.get(se_type, (0, 0))
+                timings[se_type] = (count + timing['count'], seconds + timing['seconds'])
+    for se_type, (count, seconds) in timings.items():
+        if count:
+            costs[se_type] = seconds / count
+    ensure_dir(args.cache_dir)
+    with open(f'{args.cache_dir}/render_costs.json', 'w', encoding='utf-8') as file:
+        json_str = json.dumps(costs, indent=2, sort_keys=True)
+        file.write(json_str)
+
+def write_render_report(report_filenames):
+    # NOTE: Merge the render reports of make.js of each shard, and summarize where the render time went by template and by card.
+    merged = {'shards': [], 'types': {}, 'cards': []}
+    for i, filename in enumerate(report_filenames):
+        if not os.path.isfile(filename):
+            continue
+        with open(filename, 'r', encoding='utf-8') as file:
+            report = json.loads(file.read())
+        seconds = sum(timing.get('seconds', 0) for timing in report['types'].values())
+        peak = max((snapshot['used'] for snapshot in report['memory']), default=0)
+        merged['shards'].append({'shard': i, 'cards': len(report['cards']), 'reused': report.get('reused', 0), 'seconds': seconds, 'memory': report['memory']})
+        for se_type, timing in report['types'].items():
+            merged_timing = merged['types'].setdefault(se_type, {})
+            for key, value in timing.items():
+                merged_timing[key] = merged_timing.get(key, 0) + value
+        merged['cards'].extend(report['cards'])
+        heap = f', peak heap {peak:.0f}MB of {report["memory"][-1]["max"]:.0f}MB' if peak else ''
+        print(f'Shard {i} rendered {len(report["cards"])} cards in {seconds:.1f}s{heap}...')
+    if not merged['shards']:
+        return
+
+    print(f'{"type":<32}{"cards":>6}{"template":>10}{"load":>8}{"sheet":>8}{"paint":>8}{"write":>8}{"total":>10}')
+    for se_type, timing in sorted(merged['types'].items(), key=lambda item: -item[1].get('seconds', 0)):
+        count = timing.get('count', 0)
+        if not count:
+            continue
+        per_card = [timing.get(key, 0) * 1000 / count for key in ['load', 'sheet', 'paint', 'write']]
+        print(f'{se_type:<32}{count:>6}{timing.get("template", 0):>9.1f}s' + ''.join(f'{ms:>6.0f}ms' for ms in per_card) + f'{timing["seconds"]:>9.1f}s')
+    for card in sorted(merged['cards'], key=lambda card: -(card['load'] + card['sheet'] + card['paint'] + card['write']))[:5]:
+        print(f'Slow card {card["name"]} ({card["type"]}) took {(card["load"] + card["sheet"] + card["paint"] + card["write"]) * 1000:.0f}ms...')
+
+    ensure_dir(args.cache_dir)
+    with open(f'{args.cache_dir}/render_report.json', 'w', encoding='utf-8') as file:
+        json_str = json.dumps(merged, indent=2, sort_keys=True)
+        file.write(json_str)
+
+def shard_csv_rows(shard_count):
+    data_dir = 'SE_Generator/data'
+    costs = read_render_costs()
+    default_cost = sum(costs.values()) / len(costs) if costs else 1
+    fields = {}
+    rows = []
+    for filename in sorted(glob.glob(f'{data_dir}/*.csv')):
+        se_type = os.path.basename(filename).replace('.csv', '')
+        with open(filename, mode='r', newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            fields[se_type] = reader.fieldnames
+            for row in reader:
+                rows.append((costs.get(se_type, default_cost), se_type, row))
+
+    # NOTE: Assign the most expensive rows first, each to the least loaded shard.
+    shards = [{} for _ in range(shard_count)]
+    loads = [(0, i) for i in range(shard_count)]
+    for cost, se_type, row in sorted(rows, key=lambda item: item[0], reverse=True):
+        load, i = heapq.heappop(loads)
+        shards[i].setdefault(se_type, []).append(row)
+        heapq.heappush(loads, (load + cost, i))
+    return fields, [shard for shard in shards if shard]
+
+def read_csv_rows(data_dir):
+    rows = {}
+    for filename in sorted(glob.glob(f'{data_dir}/*.csv')):
+        se_type = os.path.basename(filename).replace('.csv', '')
+        with open(filename, mode='r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                rows[row['file']] = (se_type, row)
+    return rows
+
+def read_render_manifest(project_folder):
+    filename = f'{project_folder}/render.json'
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, 'r', encoding='utf-8') as file:
+        return json.loads(file.read())
+
+def get_file_hash(filename):
+    with open(filename, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def link_or_copy_file(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def export_shard_bundles(bundles_folder, shard_count, portable):
+    # NOTE: A shard bundle is a self-contained copy of the project with a share of the CSV rows, which make.js can render on its own.
+    # Portable bundles carry the portraits of their cards, local ones hard link the most recently generated images of their cards for make.js to reuse.
+    fields, shards = shard_csv_rows(shard_count)
+    recreate_dir(bundles_folder)
+    generated_image_files = {} if portable else get_generated_image_files()
+    with open('SE_Generator/options.json', 'r', encoding='utf-8') as file:
+        options = json.loads(file.read())
+    bundle_folders = []
+    for i, shard in enumerate(shards):
+        bundle_folder = f'{bundles_folder}/{i}'
+        project_folder = f'{bundle_folder}/SE_Generator'
+        shutil.copytree('SE_Generator', project_folder, ignore=shutil.ignore_patterns('data', 'cards', 'images*', 'template', 'timings.json', 'report.json', 'queue'))
+        # NOTE: The templates are only read while rendering, so hard link them. Files make.js writes, like the render manifest, are copied.
+        shutil.copytree('SE_Generator/template', f'{project_folder}/template', copy_function=link_or_copy_file)
+        ensure_dir(f'{project_folder}/images')
+
+        ensure_dir(f'{project_folder}/data')
+        manifest = {'lang': args.lang, 'shard': i, 'shards': len(shards), 'image_format': args.se_image_format, 'data': {}, 'cards': {}}
+        portraits = {}
+        for se_type, rows in shard.items():
+            data_filename = f'{project_folder}/data/{se_type}.csv'
+            with open(data_filename, mode='w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, fieldnames=fields[se_type])
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    manifest['cards'][row['file']] = se_type
+                    for key in ['port0Src', 'port1Src']:
+                        if portable and row.get(key) and row[key] not in portraits:
+                            portraits[row[key]] = f'portraits/{os.path.basename(row[key])}'
+            manifest['data'][se_type] = get_file_hash(data_filename)
+        for result_id in manifest['cards']:
+            if result_id in generated_image_files:
+                link_or_copy_file(generated_image_files[result_id], f'{project_folder}/images/{os.path.basename(generated_image_files[result_id])}')
+
+        # NOTE: The CSV rows keep the original portrait paths, so that the render manifest hashes stay valid when the images are imported.
+        # make.js looks up where the portraits are within the bundle instead.
+        if portable:
+            ensure_dir(f'{bundle_folder}/portraits')
+            for portrait_filename, bundle_portrait_filename in portraits.items():
+                shutil.copyfile(portrait_filename, f'{bundle_folder}/{bundle_portrait_filename}')
+            with open(f'{project_folder}/options.json', 'w', encoding='utf-8') as file:
+                json_str = json.dumps({**options, 'portraits': portraits}, indent=2)
+                file.write(json_str)
+        with open(f'{bundle_folder}/manifest.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(manifest, indent=2, sort_keys=True)
+            file.write(json_str)
+        print(f'Exported shard {i} with {len(manifest["cards"])} cards...')
+        bundle_folders.append(bundle_folder)
+    return bundle_folders
+
+def is_card_image_valid(filename):
+    try:
+        with Image.open(filename) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+def import_shard_bundles(bundle_folders):
+    # NOTE: Import the rendered images into a new images folder, like a single run of make.js does.
+    image_folder = 'SE_Generator/images'
+    if os.path.isdir(image_folder):
+        os.rename(image_folder, f'{image_folder}-{uuid.uuid4()}')
+    ensure_dir(image_folder)
+    render_manifest = read_render_manifest('SE_Generator')
+    # NOTE: The cards may have been translated again since the bundles were exported, only import the cards whose rows are still current.
+    current_rows = read_csv_rows('SE_Generator/data')
+    for bundle_folder in bundle_folders:
+        project_folder = f'{bundle_folder}/SE_Generator'
+        with open(f'{bundle_folder}/manifest.json', 'r', encoding='utf-8') as file:
+            manifest = json.loads(file.read())
+        if manifest['lang'] != args.lang:
+            print(f'Skipping shard {bundle_folder} rendered for {manifest["lang"]}')
+            continue
+        if any(get_file_hash(f'{project_folder}/data/{se_type}.csv') != data_hash for se_type, data_hash in manifest['data'].items()):
+            print(f'Skipping shard {bundle_folder} with changed CSV files')
+            continue
+
+        extension, _ = se_image_formats[manifest['image_format']]
+        bundle_render_manifest = read_render_manifest(project_folder)
+        bundle_rows = read_csv_rows(f'{project_folder}/data')
+        missing = []
+        stale = []
+        for result_id in manifest['cards']:
+            if current_rows.get(result_id) != bundle_rows.get(result_id):
+                stale.append(result_id)
+                continue
+            bundle_image_filename = f'{project_folder}/images/{result_id}{extension}'
+            if not os.path.isfile(bundle_image_filename) or not is_card_image_valid(bundle_image_filename):
+                missing.append(result_id)
+                continue
+            shutil.move(bundle_image_filename, f'{image_folder}/{result_id}{extension}')
+            # NOTE: Every bundle starts with a copy of the whole render manifest, only take the entries of its own cards. A card without an
+            # entry, e.g. drawn by the Pillow stand-in, must be painted again by the next run rather than reuse the imported image.
+            if result_id in bundle_render_manifest:
+                render_manifest[result_id] = bundle_render_manifest[result_id]
+            else:
+                render_manifest.pop(result_id, None)
+        print(f'Imported shard {manifest["shard"]} with {len(manifest["cards"]) - len(missing) - len(stale)} cards, {len(missing)} missing, {len(stale)} changed since...')
+        for result_id in missing:
+            print(f'Missing {result_id} in shard {manifest["shard"]}')
+        for result_id in stale:
+            print(f'Skipping {result_id} in shard {manifest["shard"]} changed since exported')
+    with open('SE_Generator/render.json', 'w', encoding='utf-8') as file:
+        file.write(json.dumps(render_manifest))
+    write_render_costs([f'{bundle_folder}/SE_Generator/timings.json' for bundle_folder in bundle_folders])
+    write_render_report([f'{bundle_folder}/SE_Generator/report.json' for bundle_folder in bundle_folders])
+
+def render_images():
+    # NOTE: With several workers, each worker renders a local shard bundle, so that the workers don't share card and image folders.
+    se_service = is_se_service_running()
+    if se_service:
+        # NOTE: Jobs for the render service are local shard bundles in the queue directory, which it renders one after another.
+        bundle_folders = export_shard_bundles(f'{se_service_folder}/{uuid.uuid4()}', args.se_workers, False)
+    else:
+        bundle_folders = export_shard_bundles(f'{args.cache_dir}/se_workers', args.se_workers, False) if args.se_workers > 1 else []
+    project_roots = bundle_folders or ['.']
+    renderer = render_with_se_service if se_service else renderers[args.renderer]
+    if args.stream_pack:
+        # NOTE: Set the last images aside before rendering starts, so that only images of this run are picked up while streaming.
+        for project_root in project_roots:
+            image_folder = f'{project_root}/SE_Generator/images'
+            if os.path.isdir(image_folder):
+                os.rename(image_folder, f'{image_folder}-{uuid.uuid4()}')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(project_roots)) as executor:
+        futures = [executor.submit(renderer, project_root) for project_root in project_roots]
+        packed_deck_url_ids = set()
+        if args.stream_pack:
+            image_folders = [f'{project_root}/SE_Generator/images' for project_root in project_roots]
+            packed_deck_url_ids = stream_pack_images(image_folders, lambda: all(future.done() for future in futures))
+        for future in futures:
+            future.result()
+    if bundle_folders:
+        import_shard_bundles(bundle_folders)
+        if se_service:
+            shutil.rmtree(os.path.dirname(bundle_folders[0]))
+    else:
+        write_render_costs(['SE_Generator/timings.json'])
+        write_render_report(['SE_Generator/report.json'])
+    if args.stream_pack:
+        pack_images(packed_deck_url_ids)
+    return args.stream_pack
+
+def get_generated_image_files():
+    # NOTE: Previously generated images are kept in renamed folders, use the most recently generated image for each result.
+    image_files = {}
     for image_dir in glob.glob('SE_Generator/images*'):
         for filename in os.listdir(image_dir):
-            print(f'Packing {filename}...')
             result_id = filename.split('.')[0]
-            deck_url_id, deck_w, deck_h, deck_x, deck_y, rotate, _ = decode_result_id(result_id)
-            # NOTE: We use the English version of the url as the base image to pack to avoid repeated saving that reduces quality.
-            deck_url = url_map['en'][deck_url_id]
-            deck_image_filename = download_deck_image(deck_url)
-            if deck_url_id not in deck_images:
-                deck_images[deck_url_id] = Image.open(deck_image_filename)
-            deck_image = deck_images[deck_url_id]
-            card_image_filename = f'{image_dir}/{filename}'
-            card_image = Image.open(card_image_filename)
-            if rotate:
-                card_image = card_image.transpose(method=Image.Transpose.ROTATE_270)
-            width = deck_image.width // deck_w
-            height = deck_image.height // deck_h
-            left = deck_x * width
-            top = deck_y * height
-            card_image = card_image.resize((width, height))
-            deck_image.paste(card_image, box=(left, top))
+            image_filename = f'{image_dir}/{filename}'
+            if result_id not in image_files or os.path.getmtime(image_filename) > os.path.getmtime(image_files[result_id]):
+                image_files[result_id] = image_filename
+    return image_files
+
+def get_card_image_files():
+    image_files = get_generated_image_files()
+    # NOTE: Copies of the same face share the image generated for the first one.
+    for result_id, representative in read_face_aliases().items():
+        if representative in image_files:
+            image_files[result_id] = image_files[representative]
+    # NOTE: Images generated before for faces skipped now are left out, so that the original faces are kept.
+    skipped_result_ids = get_skipped_results()
+    return {result_id: image_file for result_id, image_file in image_files.items() if result_id not in skipped_result_ids}
+
+def get_dirty_deck_url_ids():
+    return set(decode_result_id(result_id)[0] for result_id in read_rule_manifest()['dirty'])
+
+pack_manifest = None
+def read_pack_manifest():
+    global pack_manifest
+    filename = f'{args.cache_dir}/packs/{args.lang}.json'
+    if pack_manifest is None:
+        pack_manifest = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as file:
+                pack_manifest = json.loads(file.read())
+    return pack_manifest
+
+def write_pack_manifest():
+    ensure_dir(f'{args.cache_dir}/packs')
+    if pack_manifest is not None:
+        with open(f'{args.cache_dir}/packs/{args.lang}.json', 'w', encoding='utf-8') as file:
+            json_str = json.dumps(pack_manifest, indent=2, sort_keys=True)
+            file.write(json_str)
 
+def prepare_decks_dir(deck_url_ids=None):
+    # NOTE: Deck images are kept between runs and only packed again when their inputs change, see 'pack_deck'. Unless in incremental mode,
+    # remove the deck images no longer packed, as well as temporary files left by interrupted pack workers.
     decks_dir = f'{args.decks_dir}/{args.lang}'
-    recreate_dir(decks_dir)
-    for deck_url_id, deck_image in deck_images.items():
+    ensure_dir(decks_dir)
+    if deck_url_ids is not None and not args.incremental:
+        manifest = read_pack_manifest()
+        for filename in os.listdir(decks_dir):
+            deck_url_id, extension = os.path.splitext(filename)
+            if extension == '.tmp' or deck_url_id not in deck_url_ids:
+                os.remove(f'{decks_dir}/{filename}')
+                manifest.pop(deck_url_id, None)
+    return decks_dir
+
+def get_peak_rss():
+    # NOTE: The peak resident memory of this process in MB, resource is only available on Unix, use the process memory counters on Windows.
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # NOTE: Linux reports kilobytes, macOS reports bytes.
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import ctypes
+        from ctypes import wintypes
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [(name, ctypes.c_size_t) for name in [
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage']]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 1024 / 1024
+
+# NOTE: Pillow's default JPEG quality, and the range of qualities to search for the lowest one meeting a perceptual target.
+jpeg_default_quality = 75
+jpeg_min_quality = 30
+jpeg_max_quality = 95
+deck_quality_targets = {'ssim': 0.98, 'psnr': 40}
+
+def get_deck_quality_target():
+    return args.deck_quality_target if args.deck_quality_target is not None else deck_quality_targets[args.deck_quality_metric]
+
+def get_deck_quality_reference(deck_image):
+    # NOTE: SSIM is computed on the luma only, keep it as 8-bit like the images.
+    return numpy.asarray(deck_image.convert('L') if args.deck_quality_metric == 'ssim' else deck_image)
+
+def get_deck_quality_metric(reference, image, strip_height=512):
+    # NOTE: Compare in strips of rows, so that the metric doesn't hold more than a few copies of a strip besides the two images.
+    if args.deck_quality_metric == 'psnr':
+        actual = numpy.asarray(image)
+        squared_error = 0
+        for top in range(0, reference.shape[0], strip_height):
+            difference = reference[top:top + strip_height].astype(numpy.int16) - actual[top:top + strip_height]
+            squared_error += numpy.einsum('ijk,ijk->', difference, difference, dtype=numpy.int64)
+        mse = squared_error / reference.size
+        return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+    # NOTE: SSIM over 8x8 blocks, which are what JPEG quantizes.
+    actual = numpy.asarray(image.convert('L'))
+    height = reference.shape[0] // 8 * 8
+    width = reference.shape[1] // 8 * 8
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    total = 0.0
+    count = 0
+    for top in range(0, height, strip_height):
+        bottom = min(top + strip_height, height)
+        x = reference[top:bottom, :width].astype(numpy.float32).reshape((bottom - top) // 8, 8, width // 8, 8)
+        y = actual[top:bottom, :width].astype(numpy.float32).reshape((bottom - top) // 8, 8, width // 8, 8)
+        mean_x = x.mean(axis=(1, 3))
+        mean_y = y.mean(axis=(1, 3))
+        variance_x = (x * x).mean(axis=(1, 3)) - mean_x * mean_x
+        variance_y = (y * y).mean(axis=(1, 3)) - mean_y * mean_y
+        covariance = (x * y).mean(axis=(1, 3)) - mean_x * mean_y
+        ssim = (2 * mean_x * mean_y + c1) * (2 * covariance + c2) / ((mean_x * mean_x + mean_y * mean_y + c1) * (variance_x + variance_y + c2))
+        total += float(ssim.sum(dtype=numpy.float64))
+        count += ssim.size
+    return total / count
+
+def encode_deck_image(deck_image):
+    def encode(quality):
+        buffer = io.BytesIO()
+        deck_image.save(buffer, format='JPEG', quality=quality, progressive=True, optimize=True)
+        return buffer.getvalue()
+
+    start = time.perf_counter()
+    default_data = encode(jpeg_default_quality)
+    if not args.deck_quality_metric:
+        return default_data, None
+
+    # NOTE: Binary search for the lowest quality meeting the target, while the search stays within the time budget, measured in multiples
+    # of the default encode time. The budget counts from the default encode, so the reference and the check of the default quality are
+    # spent from it too. They always run, further steps stop before a step that would likely run over.
+    deadline = start + (time.perf_counter() - start) * args.deck_quality_budget
+    target = get_deck_quality_target()
+    reference = get_deck_quality_reference(deck_image)
+    results = {}
+    def measure(quality, data):
+        with Image.open(io.BytesIO(data)) as image:
+            results[quality] = (get_deck_quality_metric(reference, image), data)
+        return results[quality][0] >= target
+
+    step_start = time.perf_counter()
+    if measure(jpeg_default_quality, default_data):
+        low, high = jpeg_min_quality, jpeg_default_quality - 1
+    else:
+        low, high = jpeg_default_quality + 1, jpeg_max_quality
+    step_time = time.perf_counter() - step_start
+    while low <= high and time.perf_counter() + step_time < deadline:
+        step_start = time.perf_counter()
+        quality = (low + high) // 2
+        if measure(quality, encode(quality)):
+            high = quality - 1
+        else:
+            low = quality + 1
+        step_time = time.perf_counter() - step_start
+
+    # NOTE: If no quality tried meets the target, e.g. for noisy scans, keep the default quality rather than growing the deck image.
+    passing = [quality for quality, (metric, _) in results.items() if metric >= target]
+    quality = min(passing) if passing else jpeg_default_quality
+    metric, data = results[quality]
+    return data, {'quality': quality, args.deck_quality_metric: metric, 'bytes': len(data), 'default_bytes': len(default_data)}
+
+def pack_deck(deck_url_id, card_image_files, decks_dir, packed):
+    # NOTE: We use the English version of the url as the base image to pack to avoid repeated saving that reduces quality.
+    # It's downloaded and validated by 'prepare_deck_images' before packing starts.
+    deck_image_filename = get_cached_deck_image_filename(deck_url_id)
+    ensure_deck_size(deck_url_id, deck_image_filename)
+    # NOTE: The inputs of a deck image are the content of its base image and of each card image pasted into it. Leave the deck image
+    # untouched if they're the same as when it was packed, so that it's not encoded again, nor uploaded again by 'upload_images'.
+    file_hashes = {}
+    for filename in [deck_image_filename] + list(card_image_files.values()):
+        if filename not in file_hashes:
+            file_hashes[filename] = get_file_hash(filename)
+    inputs = {'base': file_hashes[deck_image_filename], 'cards': {result_id: file_hashes[filename] for result_id, filename in card_image_files.items()}}
+    if args.deck_quality_metric:
+        inputs['encoding'] = [args.deck_quality_metric, get_deck_quality_target(), args.deck_quality_budget]
+    # NOTE: Besides the inputs, the pack manifest records the setting each deck image was encoded with and the hash it was last uploaded with.
+    if packed and {key: value for key, value in packed.items() if key not in ['encoded', 'uploaded']} == inputs and os.path.isfile(f'{decks_dir}/{deck_url_id}.jpg'):
+        print(f'Keeping {deck_url_id}.jpg...')
+        return packed, get_peak_rss()
+
+    # NOTE: Close every image as soon as it's pasted or written, so that a worker only holds one deck image at a time.
+    with Image.open(deck_image_filename) as deck_image:
+        for result_id, card_image_filename in card_image_files.items():
+            _, _, _, deck_x, deck_y, rotate, _ = decode_result_id(result_id)
+            print(f'Packing {result_id}...')
+            with Image.open(card_image_filename) as card_image:
+                if rotate:
+                    card_image = card_image.transpose(method=Image.Transpose.ROTATE_270)
+                width, height = get_card_slot_size(result_id)
+                left = deck_x * width
+                top = deck_y * height
+                deck_image.paste(card_image.resize((width, height)), box=(left, top))
+
         print(f'Writing {deck_url_id}.jpg...')
-        deck_image = deck_image.convert('RGB')
-        deck_image.save(f'{decks_dir}/{deck_url_id}.jpg', progressive=True, optimize=True)
+        if deck_image.mode != 'RGB':
+            deck_image = deck_image.convert('RGB')
+        data, encoded = encode_deck_image(deck_image)
+        if encoded:
+            inputs['encoded'] = encoded
+        # NOTE: Write to a temporary file first, so that an interrupted or failed worker never leaves a partial deck image behind.
+        temp_filename = f'{decks_dir}/{deck_url_id}.{uuid.uuid4()}.tmp'
+        try:
+            with open(temp_filename, 'wb') as file:
+                file.write(data)
+            os.replace(temp_filename, f'{decks_dir}/{deck_url_id}.jpg')
+        finally:
+            if os.path.isfile(temp_filename):
+                os.remove(temp_filename)
+    return inputs, get_peak_rss()
+
+def prepare_deck_images(deck_url_ids):
+    # NOTE: Download the English deck images and read their sizes before packing, so that the pack workers only read cached files.
+    url_map, _ = read_url_map()
+    deck_image_filenames = download_deck_images([url_map['en'][deck_url_id] for deck_url_id in deck_url_ids])
+    for deck_url_id in deck_url_ids:
+        ensure_deck_size(deck_url_id, deck_image_filenames[url_map['en'][deck_url_id]])
+    write_deck_geometry()
+
+def get_pack_executor():
+    # NOTE: Each worker packs whole decks, decoding, compositing and encoding are CPU bound, so they run in separate processes.
+    if args.pack_workers > 1:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=args.pack_workers)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def get_deck_pack_memory(deck_url_id):
+    # NOTE: A deck being packed holds its decoded RGB pixels, and about as much again for the card images and the JPEG encoder.
+    # Searching for a quality also holds a decoded copy of each try, the reference for the metric and a strip of float copies.
+    width, height = get_deck_size(deck_url_id)
+    return width * height * 3 * (3 if args.deck_quality_metric else 2)
+
+def submit_pack_decks(executor, futures, ready_deck_card_image_files, decks_dir):
+    # NOTE: Start packing the ready decks in order, as long as the decks being packed fit in the memory budget. One deck is always packed.
+    memory = sum(get_deck_pack_memory(deck_url_id) for deck_url_id in futures)
+    while ready_deck_card_image_files:
+        deck_url_id, card_image_files = next(iter(ready_deck_card_image_files.items()))
+        deck_memory = get_deck_pack_memory(deck_url_id)
+        if futures and memory + deck_memory > args.pack_memory * 1024 * 1024:
+            break
+        del ready_deck_card_image_files[deck_url_id]
+        futures[deck_url_id] = executor.submit(pack_deck, deck_url_id, card_image_files, decks_dir, read_pack_manifest().get(deck_url_id))
+        memory += deck_memory
+
+def report_pack_memory(worker_peak_rss):
+    print(f'Peak memory {get_peak_rss():.0f}MB in the main process, {worker_peak_rss:.0f}MB in a pack worker...')
+
+def report_deck_encoding(deck_url_ids):
+    encoded = [read_pack_manifest()[deck_url_id]['encoded'] for deck_url_id in deck_url_ids if 'encoded' in read_pack_manifest().get(deck_url_id, {})]
+    if encoded:
+        total_bytes = sum(deck_encoded['bytes'] for deck_encoded in encoded)
+        default_bytes = sum(deck_encoded['default_bytes'] for deck_encoded in encoded)
+        # NOTE: Meeting the target can take a quality above the default, which costs bytes rather than saving them.
+        if total_bytes <= default_bytes:
+            change = f'saving {(default_bytes - total_bytes) / 1024 / 1024:.1f}MB of {default_bytes / 1024 / 1024:.1f}MB'
+        else:
+            change = f'{(total_bytes - default_bytes) / 1024 / 1024:.1f}MB more than {default_bytes / 1024 / 1024:.1f}MB at the default quality'
+        print(f'Encoded {len(encoded)} deck images to {args.deck_quality_metric} {get_deck_quality_target()} in {total_bytes / 1024 / 1024:.1f}MB, {change}...')
+
+def get_deck_card_image_files(card_image_files):
+    deck_card_image_files = {}
+    dirty_deck_url_ids = get_dirty_deck_url_ids()
+    for result_id, card_image_filename in card_image_files.items():
+        deck_url_id = decode_result_id(result_id)[0]
+        # NOTE: In incremental mode, only decks with cards affected by changes since the last upload are packed again.
+        if args.incremental and deck_url_id not in dirty_deck_url_ids:
+            continue
+        deck_card_image_files.setdefault(deck_url_id, {})[result_id] = card_image_filename
+    # NOTE: A deck image uploaded before whose faces are all skipped now is packed without any card, to restore its original faces.
+    url_map, _ = read_url_map()
+    for result_id in get_skipped_results():
+        deck_url_id = decode_result_id(result_id)[0]
+        if deck_url_id in url_map.get(args.lang, {}) and (not args.incremental or deck_url_id in dirty_deck_url_ids):
+            deck_card_image_files.setdefault(deck_url_id, {})
+    return deck_card_image_files
+
+def pack_images(packed_deck_url_ids=None):
+    # NOTE: Decks already packed while streaming are left as they are.
+    deck_card_image_files = get_deck_card_image_files(get_card_image_files())
+    decks_dir = prepare_decks_dir(deck_card_image_files)
+    deck_url_ids = [deck_url_id for deck_url_id in deck_card_image_files if packed_deck_url_ids is None or deck_url_id not in packed_deck_url_ids]
+    prepare_deck_images(deck_url_ids)
+    ready_deck_card_image_files = {deck_url_id: deck_card_image_files[deck_url_id] for deck_url_id in deck_url_ids}
+    futures = {}
+    worker_peak_rss = 0
+    # NOTE: Write the manifest even if a deck fails, so that the decks packed before it are not packed again.
+    try:
+        with get_pack_executor() as executor:
+            while ready_deck_card_image_files or futures:
+                submit_pack_decks(executor, futures, ready_deck_card_image_files, decks_dir)
+                done, _ = concurrent.futures.wait(futures.values(), return_when=concurrent.futures.FIRST_COMPLETED)
+                for deck_url_id, future in list(futures.items()):
+                    if future in done:
+                        del futures[deck_url_id]
+                        read_pack_manifest()[deck_url_id], peak_rss = future.result()
+                        worker_peak_rss = max(worker_peak_rss, peak_rss)
+    finally:
+        write_pack_manifest()
+    if deck_url_ids:
+        report_pack_memory(worker_peak_rss)
+        report_deck_encoding(deck_url_ids)
+
+def stream_pack_images(image_folders, is_render_done):
+    # NOTE: Each deck waits for the cards rendered in this run, copies of the same face wait for the card they share the image with.
+    waiting_result_ids = {}
+    aliases = {}
+    for result_id, representative in read_face_aliases().items():
+        aliases.setdefault(representative, []).append(result_id)
+    for result_id in get_csv_result_ids():
+        for card_result_id in [result_id] + aliases.get(result_id, []):
+            waiting_result_ids.setdefault(decode_result_id(card_result_id)[0], set()).add(result_id)
+    # NOTE: Group the card images by deck once, and add the rendered images to it as they arrive.
+    deck_card_image_files = get_deck_card_image_files(get_card_image_files())
+    dirty_deck_url_ids = get_dirty_deck_url_ids()
+    added_image_files = {}
+    decks_dir = prepare_decks_dir()
+    prepare_deck_images(list(waiting_result_ids))
+
+    packed_deck_url_ids = set()
+    failed_deck_url_ids = set()
+    ready_deck_card_image_files = {}
+    futures = {}
+    worker_peak_rss = 0
+    try:
+        with get_pack_executor() as executor:
+            while True:
+                render_done = is_render_done()
+                # NOTE: Images still being written are skipped, unless rendering is done.
+                rendered_image_files = {}
+                for image_folder in image_folders:
+                    if not os.path.isdir(image_folder):
+                        continue
+                    for filename in os.listdir(image_folder):
+                        image_filename = f'{image_folder}/{filename}'
+                        if render_done or time.time() - os.path.getmtime(image_filename) > 1:
+                            rendered_image_files[filename.split('.')[0]] = image_filename
+                for result_id, image_filename in rendered_image_files.items():
+                    if added_image_files.get(result_id) == image_filename:
+                        continue
+                    added_image_files[result_id] = image_filename
+                    for card_result_id in [result_id] + aliases.get(result_id, []):
+                        deck_url_id = decode_result_id(card_result_id)[0]
+                        # NOTE: In incremental mode, only decks with cards affected by changes since the last upload are packed again.
+                        if args.incremental and deck_url_id not in dirty_deck_url_ids:
+                            continue
+                        deck_card_image_files.setdefault(deck_url_id, {})[card_result_id] = image_filename
+                for deck_url_id, result_ids in waiting_result_ids.items():
+                    if deck_url_id in packed_deck_url_ids or deck_url_id in futures or deck_url_id in ready_deck_card_image_files:
+                        continue
+                    if deck_url_id in failed_deck_url_ids or not result_ids.issubset(rendered_image_files):
+                        continue
+                    if deck_url_id not in deck_card_image_files:
+                        continue
+                    ready_deck_card_image_files[deck_url_id] = dict(deck_card_image_files[deck_url_id])
+                submit_pack_decks(executor, futures, ready_deck_card_image_files, decks_dir)
+                # NOTE: Once rendering is done, keep packing the decks left within the memory budget until all are packed.
+                if render_done:
+                    concurrent.futures.wait(futures.values(), return_when=concurrent.futures.FIRST_COMPLETED)
+                for deck_url_id, future in list(futures.items()):
+                    if not future.done():
+                        continue
+                    del futures[deck_url_id]
+                    try:
+                        read_pack_manifest()[deck_url_id], peak_rss = future.result()
+                        worker_peak_rss = max(worker_peak_rss, peak_rss)
+                    except OSError as e:
+                        print(f'Packing {deck_url_id}.jpg again later: {e}')
+                        # NOTE: Decks failing after rendering is done are left to be packed once more after streaming.
+                        if render_done:
+                            failed_deck_url_ids.add(deck_url_id)
+                        continue
+                    packed_deck_url_ids.add(deck_url_id)
+                if render_done and not ready_deck_card_image_files and not futures:
+                    break
+                if not render_done:
+                    time.sleep(1)
+    finally:
+        write_pack_manifest()
+    report_pack_memory(worker_peak_rss)
+    report_deck_encoding(packed_deck_url_ids)
+    return packed_deck_url_ids
 
 def upload_images():
     dbx = dropbox.Dropbox(args.dropbox_token)
@@ -2296,7 +4233,24 @@ def upload_images():
     except:
         pass
     decks_dir = f'{args.decks_dir}/{args.lang}'
+    dirty_deck_url_ids = get_dirty_deck_url_ids()
+    url_map, _ = read_url_map()
+    manifest = read_pack_manifest()
+    uploaded_deck_url_ids = set()
     for filename in os.listdir(decks_dir):
+        # NOTE: Temporary files left by interrupted pack workers are never uploaded.
+        if not filename.endswith('.jpg'):
+            continue
+        url_id = filename.split('.')[0]
+        # NOTE: In incremental mode, only decks packed again since the last upload are uploaded.
+        if args.incremental and url_id not in dirty_deck_url_ids:
+            continue
+        # NOTE: Decks kept by 'pack_deck' are the same as when they were last uploaded, skip them unless their link is missing or forced anew.
+        deck_hash = get_file_hash(f'{decks_dir}/{filename}')
+        if not args.new_link and url_id in url_map.get(args.lang, {}) and manifest.get(url_id, {}).get('uploaded') == deck_hash:
+            print(f'Skipping {filename}...')
+            uploaded_deck_url_ids.add(url_id)
+            continue
         print(f'Uploading {filename}...')
         with open(f'{decks_dir}/{filename}', 'rb') as file:
             deck_image_data = file.read()
@@ -2311,8 +4265,12 @@ def upload_images():
             url = dbx.sharing_create_shared_link(image.path_display, short_url=True).url
             # NOTE: Get direct download link from the dropbox sharing link.
             url = url.replace('?dl=0', '').replace('www.dropbox.com', 'dl.dropboxusercontent.com')
-            url_id = filename.split('.')[0]
             set_url_id(url_id, url)
+            uploaded_deck_url_ids.add(url_id)
+            if url_id in manifest:
+                manifest[url_id]['uploaded'] = deck_hash
+                write_pack_manifest()
+    clean_dirty_results(uploaded_deck_url_ids)
 
 updated_files = {}
 def update_sced_card_object(object, metadata, card, filename, root):
@@ -2361,22 +4319,45 @@ def update_sced_files():
             json_str = re.sub(r'(\d+)e-(\d\d)', r'\1E-\2', json_str)
             file.write(json_str)
 
-if args.step in [None, steps[0]]:
-    process_player_cards(translate_sced_object)
-    process_encounter_cards(translate_sced_object)
-    write_csv()
-
-if args.step in [None, steps[1]]:
-    generate_images()
-
-if args.step in [None, steps[2]]:
-    pack_images()
-
-if args.step in [None, steps[3]]:
-    upload_images()
-
-if args.step in [None, steps[4]]:
-    process_player_cards(update_sced_card_object)
-    process_encounter_cards(update_sced_card_object, include_decks=True)
-    update_sced_files()
+# NOTE: Pack workers are new processes which import this script for its functions, only run the automation steps in the main process.
+if __name__ == '__main__':
+    if args.se_service:
+        run_se_service()
+        sys.exit()
+
+    if args.benchmark == 'crop':
+        benchmark_crop_formats()
+        sys.exit()
+    if args.benchmark == 'handoff':
+        benchmark_handoff_formats()
+        sys.exit()
+
+    if args.step in [None, steps[0]]:
+        if args.select:
+            report_selection()
+        report_changed_rules()
+        process_player_cards(translate_sced_object)
+        process_encounter_cards(translate_sced_object)
+        translate_pending_cards()
+        write_csv()
+        write_result_map()
+        write_rule_manifest()
+        write_face_aliases()
+        write_translation_coverage()
+
+    packed = False
+    if args.step in [None, steps[1]]:
+        packed = generate_images()
+
+    # NOTE: When streaming, deck images are packed while rendering, unless nothing was rendered, e.g. when importing shard bundles.
+    if args.step in [None, steps[2]] and not packed:
+        pack_images()
+
+    if args.step in [None, steps[3]]:
+        upload_images()
+
+    if args.step in [None, steps[4]]:
+        process_player_cards(update_sced_card_object)
+        process_encounter_cards(update_sced_card_object, include_decks=True)
+        update_sced_files()
 